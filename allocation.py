@@ -0,0 +1,75 @@
+from sqlalchemy import select, update
+from models import db, ParkingSpot, Reservation
+from occupancy import adjust_lot_counts
+from spot_index import get_lot_index
+
+
+# How many candidates "any free spot" tries before giving up under contention
+MAX_CLAIM_ATTEMPTS = 5
+
+
+# Flip one spot from old_status to new_status with a single conditional UPDATE.
+# Returns True only for the caller whose UPDATE actually matched the row.
+def _swap_status(spot_id, lot_id, old_status, new_status):
+    result = db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == spot_id, ParkingSpot.lot_id == lot_id, ParkingSpot.status == old_status)
+        .values(status=new_status),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount != 1:
+        return False
+    adjust_lot_counts(lot_id, old_status, new_status, spot_id=spot_id)
+    return True
+
+
+def _next_free_spot_id(lot_id):
+    query = select(ParkingSpot.id).where(
+        ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A'
+    ).order_by(ParkingSpot.id).limit(1)
+    # On Postgres concurrent bookers skip rows another transaction already holds
+    if db.engine.dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    return db.session.execute(query).scalar()
+
+
+# Claim a spot in lot_id for the current transaction.
+# With spot_id, claims exactly that spot; without it, claims the first free spot.
+# expected_free is the lot's available_count, if the caller has it.
+# Returns the claimed spot id, or None if nothing could be claimed.
+def claim_spot(lot_id, spot_id=None, expected_free=None):
+    if spot_id is not None:
+        return spot_id if _swap_status(spot_id, lot_id, 'A', 'O') else None
+
+    # Try the in-memory index first. Whatever happens, the candidate is no longer
+    # free for other bookers in this process; after a rollback its free count
+    # no longer matches expected_free and the lot is reloaded.
+    index = get_lot_index(lot_id, expected_free)
+    candidate = index.take_first_free() if index is not None else None
+    if candidate is not None and _swap_status(candidate, lot_id, 'A', 'O'):
+        return candidate
+
+    for _ in range(MAX_CLAIM_ATTEMPTS):
+        candidate = _next_free_spot_id(lot_id)
+        if candidate is None:
+            return None
+        if _swap_status(candidate, lot_id, 'A', 'O'):
+            return candidate
+    return None
+
+
+# Hand an occupied spot back. Returns False if it was not occupied.
+def free_spot(spot_id, lot_id):
+    return _swap_status(spot_id, lot_id, 'O', 'A')
+
+
+# End an Active reservation as `status` with a single conditional UPDATE (the
+# reservation object is updated in place). Returns False if it was no longer
+# Active: released twice, or expired by a sweep in the meantime.
+def close_reservation(reservation, status, end_time, final_cost):
+    result = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation.id, Reservation.status == 'Active')
+        .values(status=status, end_time=end_time, final_cost=final_cost)
+    )
+    return result.rowcount == 1
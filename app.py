@@ -10,5 +10,11 @@ from controllers import register_blueprints
 
 register_blueprints(app)
 
+import assets
+
+import fragment_cache
+
+import commands
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,220 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import urllib.request
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+from app import app
+
+try:
+    import brotli
+except ImportError:  # optional: only gzip variants are written and served
+    brotli = None
+
+
+# Static assets: fingerprinted URLs, precompressed variants and vendored libraries.
+#
+# url_for('static', filename='css/admin.css') gives /static/css/admin.<hash>.css,
+# the hash being the start of the file's SHA-256. The static view takes the hash
+# back off; a URL with the current hash is cached for ASSET_MAX_AGE and marked
+# immutable, since a changed file gets a new URL. Other requests are served as
+# before (conditional on ETag, SEND_FILE_MAX_AGE_DEFAULT).
+#
+# `flask compress-assets` writes .gz (and .br, with the brotli package) next to
+# the text assets. Clients accepting the encoding get those, unless the variant
+# is older than the file.
+#
+# VENDOR pins the third-party libraries the templates use. Downloading them into
+# static/vendor with `flask vendor-assets` is part of the build, like
+# compress-assets: pages are only served from this app, so url_for() for a
+# vendored file that is missing raises MissingVendorAsset.
+
+VENDOR_BOOTSTRAP = 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist'
+VENDOR_FONTAWESOME = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.7.2'
+
+# static path: URL it is downloaded from
+VENDOR = {
+    'vendor/bootstrap/css/bootstrap.min.css': f'{VENDOR_BOOTSTRAP}/css/bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.bundle.min.js': f'{VENDOR_BOOTSTRAP}/js/bootstrap.bundle.min.js',
+    'vendor/chartjs/chart.umd.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.1/dist/chart.umd.js',
+    'vendor/inter/inter-latin-wght-normal.woff2':
+        'https://cdn.jsdelivr.net/npm/@fontsource-variable/inter@5.0.16/files/inter-latin-wght-normal.woff2',
+    'vendor/fontawesome/css/all.min.css': f'{VENDOR_FONTAWESOME}/css/all.min.css',
+    # Loaded by all.min.css through ../webfonts/
+    **{
+        f'vendor/fontawesome/webfonts/{font}.{ext}': f'{VENDOR_FONTAWESOME}/webfonts/{font}.{ext}'
+        for font in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility')
+        for ext in ('woff2', 'ttf')
+    },
+}
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.ttf')
+# Below this the encoding headers cost about what compression saves
+COMPRESS_MIN_BYTES = 512
+# (Content-Encoding, file suffix), most preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_FINGERPRINTED = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)$')
+
+_digests = {}  # filename -> (mtime_ns, size, digest)
+
+
+class MissingVendorAsset(RuntimeError):
+    def __init__(self, filename):
+        super().__init__(f'static/{filename} is missing; run `flask vendor-assets`')
+
+
+# The content hash of a static file, or None if there is no such file
+def digest(filename):
+    path = safe_join(app.static_folder, filename)
+    try:
+        stat = os.stat(path) if path else None
+    except OSError:
+        stat = None
+    if stat is None:
+        return None
+    cached = _digests.get(filename)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    with open(path, 'rb') as f:
+        value = hashlib.sha256(f.read()).hexdigest()[:12]
+    _digests[filename] = (stat.st_mtime_ns, stat.st_size, value)
+    return value
+
+
+def fingerprinted(filename):
+    value = digest(filename)
+    if value is None:
+        return filename
+    stem, ext = os.path.splitext(filename)
+    return f'{stem}.{value}{ext}'
+
+
+# (filename, hash) for a fingerprinted name, (filename, None) otherwise
+def split_fingerprint(filename):
+    match = _FINGERPRINTED.match(filename)
+    if match is None:
+        return filename, None
+    return match.group(1) + match.group(3), match.group(2)
+
+
+# ------------------------------------------------------ SERVING -----------------------------------------------------
+
+# VENDOR files that have not been downloaded
+def missing_vendor():
+    return [filename for filename in VENDOR if digest(filename) is None]
+
+
+def _fingerprint_static(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        filename = values['filename']
+        if filename in VENDOR and digest(filename) is None:
+            raise MissingVendorAsset(filename)
+        values['filename'] = fingerprinted(filename)
+
+
+# The precompressed variant of path this client should get, if any
+def _encoded(path):
+    if not path.endswith(COMPRESSIBLE):
+        return None, path
+    mtime = os.stat(path).st_mtime_ns
+    for encoding, suffix in ENCODINGS:
+        if not request.accept_encodings[encoding]:
+            continue
+        try:
+            if os.stat(path + suffix).st_mtime_ns >= mtime:
+                return encoding, path + suffix
+        except OSError:
+            continue
+    return None, path
+
+
+def send_static(filename):
+    name, requested = split_fingerprint(filename)
+    path = safe_join(app.static_folder, name)
+    if path is None:
+        abort(404)
+    if not os.path.isfile(path):
+        abort(404)
+
+    encoding, served = _encoded(path)
+    immutable = requested is not None and requested == digest(name)
+    response = send_file(
+        served, mimetype=mimetypes.guess_type(name)[0] or 'application/octet-stream', conditional=True,
+        max_age=app.config['ASSET_MAX_AGE'] if immutable else app.get_send_file_max_age(name)
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if path.endswith(COMPRESSIBLE):
+        response.vary.add('Accept-Encoding')
+    if immutable:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    return response
+
+
+# ------------------------------------------------------- BUILD ------------------------------------------------------
+
+# Downloads the VENDOR files that are missing (all with force); yields
+# (filename, bytes written)
+def vendor(force=False):
+    for filename, url in VENDOR.items():
+        path = os.path.join(app.static_folder, filename)
+        if os.path.exists(path) and not force:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with urllib.request.urlopen(url, timeout=30) as response:
+                data = response.read()
+        except OSError as exc:
+            raise OSError(f'{filename} ({url}): {exc}') from exc
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+        yield filename, len(data)
+
+
+def _compressors():
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+# Writes the precompressed variants that are missing or older than their file;
+# yields (filename, original size, {suffix: compressed size})
+def compress(force=False):
+    compressors = list(_compressors())
+    for root, _, files in os.walk(app.static_folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not name.endswith(COMPRESSIBLE) or os.path.getsize(path) < COMPRESS_MIN_BYTES:
+                continue
+            mtime = os.stat(path).st_mtime_ns
+            data = None
+            sizes = {}
+            for suffix, compressor in compressors:
+                target = path + suffix
+                if not force and os.path.exists(target) and os.stat(target).st_mtime_ns >= mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                encoded = compressor(data)
+                if len(encoded) >= len(data):
+                    continue
+                with open(target + '.tmp', 'wb') as f:
+                    f.write(encoded)
+                os.replace(target + '.tmp', target)
+                sizes[suffix] = len(encoded)
+            if sizes:
+                yield os.path.relpath(path, app.static_folder), len(data), sizes
+
+
+def install():
+    app.url_defaults(_fingerprint_static)
+    app.view_functions['static'] = send_static
+
+
+install()
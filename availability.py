@@ -0,0 +1,77 @@
+import hashlib
+from flask import jsonify, make_response, request
+from app import app
+from models import db, ParkingLot
+from spot_index import list_free_spots
+
+
+# Availability snapshots for polling clients, with ETags built from the lots'
+# occupancy_version counters (bumped by occupancy.py on every booking, release
+# and spot change). Working out the ETag reads only parking_lot, so a client
+# whose copy is current gets a 304 without the spot table being touched.
+#
+# A new lot's version starts at 0 and SQLite can hand a deleted lot's id to a
+# new one, so the ETags also carry when the lot was created: a recreated lot
+# never matches what a client cached for its predecessor.
+
+def _lot_tag(lot):
+    created = lot.created_on.strftime('%Y%m%d%H%M%S%f') if lot.created_on else '0'
+    return f'{lot.id}-{created}-v{lot.occupancy_version}'
+
+
+# `lot`: anything with id, created_on and occupancy_version (a ParkingLot or a row)
+def lot_etag(lot):
+    return 'lot-' + _lot_tag(lot)
+
+
+def lots_etag(lots):
+    digest = hashlib.sha1(','.join(_lot_tag(lot) for lot in lots).encode())
+    return 'lots-' + digest.hexdigest()[:20]
+
+
+def _lot_summary(lot):
+    return {
+        'id': lot.id,
+        'name': lot.name,
+        'price_per_hour': lot.price_per_hour,
+        'available': lot.available_count,
+        'occupied': lot.occupied_count,
+        'maintenance': lot.maintenance_count,
+        'total': lot.available_count + lot.occupied_count + lot.maintenance_count,
+        'version': lot.occupancy_version,
+    }
+
+
+def all_lots():
+    return ParkingLot.query.order_by(ParkingLot.id).all()
+
+
+def lots_payload(lots):
+    return {'lots': [_lot_summary(lot) for lot in lots]}
+
+
+def lot_payload(lot):
+    payload = _lot_summary(lot)
+    payload['spots'] = [
+        {'id': spot.id, 'spot_number': spot.spot_number}
+        for spot in list_free_spots(lot.id, lot.available_count)
+    ]
+    return payload
+
+
+# JSON response for `etag`: 304 when the client already has it, otherwise the
+# result of build(). Public responses may be kept by shared caches; either way
+# clients reuse them for AVAILABILITY_MAX_AGE seconds, then revalidate.
+def conditional_json(etag, build, public=True):
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    response.cache_control.max_age = app.config['AVAILABILITY_MAX_AGE']
+    response.cache_control.must_revalidate = True
+    return response
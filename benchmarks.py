@@ -0,0 +1,372 @@
+import http.client
+import json
+import math
+import threading
+import time
+from collections import defaultdict, namedtuple
+from urllib.parse import urlencode
+from flask import g, has_request_context, request, request_finished, url_for
+from sqlalchemy import delete, event, select
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+from app import app
+from models import db, Address, User, Vehicle, ParkingLot, Reservation, DailyLotStats, DailyUserStats
+from provisioning import remove_lot
+from seed import seed as seed_data
+
+
+# Benchmark suite for the booking flow (`flask bench`).
+#
+# Every scenario drives one real endpoint, either in-process through the Flask
+# test client or over HTTP against a local threaded server with one client
+# thread per simulated user. Before the run a fixture of bench users, lots and
+# reservation history is built at the chosen scale; it is removed afterwards.
+# Each endpoint reports p50/p95/p99 latency, throughput and SQL statements per
+# request (counted on the server side). A run can be saved as a JSON baseline
+# and later runs compared against it.
+#
+# The fixture is generated by seed.py and removed with its daily rollups.
+# Run it against a scratch database all the same (SQLALCHEMY_DATABASE_URI).
+
+Scale = namedtuple('Scale', 'users lots spots_per_lot reservations')
+
+SCALES = {
+    'small': Scale(100, 5, 100, 10_000),
+    'medium': Scale(1_000, 20, 500, 200_000),
+    'large': Scale(10_000, 50, 2_000, 1_000_000),
+}
+
+EMAIL_DOMAIN = '@bench.invalid'
+LOT_PREFIX = 'bench-lot-'
+PASSWORD = 'bench'
+HISTORY_DAYS = 90
+
+
+# ----------------------------------------------------- FIXTURE -----------------------------------------------------
+
+Fixture = namedtuple('Fixture', 'admin_email user_emails lot_ids')
+
+
+def _bench_user_ids():
+    return select(User.id).where(User.email.like('%' + EMAIL_DOMAIN))
+
+
+# Remove everything a previous run created (also after a crash or --keep)
+def remove_fixture():
+    unsynchronized = {'synchronize_session': False}
+    db.session.execute(delete(Reservation).where(Reservation.user_id.in_(_bench_user_ids())),
+                       execution_options=unsynchronized)
+    lots = db.session.execute(
+        select(ParkingLot.id, ParkingLot.address_id).where(ParkingLot.name.like(LOT_PREFIX + '%'))
+    ).all()
+    for lot_id, _ in lots:
+        remove_lot(lot_id)
+    db.session.execute(delete(DailyLotStats).where(DailyLotStats.lot_id.in_({lot_id for lot_id, _ in lots})),
+                       execution_options=unsynchronized)
+    db.session.execute(delete(DailyUserStats).where(DailyUserStats.user_id.in_(_bench_user_ids())),
+                       execution_options=unsynchronized)
+    db.session.execute(delete(Vehicle).where(Vehicle.user_id.in_(_bench_user_ids())),
+                       execution_options=unsynchronized)
+    address_ids = {address_id for _, address_id in lots} | set(db.session.execute(
+        select(User.address_id).where(User.email.like('%' + EMAIL_DOMAIN), User.address_id.isnot(None))
+    ).scalars())
+    db.session.execute(delete(User).where(User.email.like('%' + EMAIL_DOMAIN)), execution_options=unsynchronized)
+    db.session.execute(delete(Address).where(Address.id.in_(address_ids)), execution_options=unsynchronized)
+    db.session.commit()
+
+
+# One admin plus the seed.py data set at this scale over the last
+# HISTORY_DAYS days, with every spot free; the same for the same seed
+def build_fixture(scale, seed=0):
+    admin_email = 'admin' + EMAIL_DOMAIN
+    db.session.add(User(full_name='Bench Admin', email=admin_email, password=generate_password_hash(PASSWORD),
+                        is_admin=True))
+    db.session.commit()
+    seeded = seed_data(users=scale.users, lots=scale.lots, spots_per_lot=scale.spots_per_lot,
+                       reservations=scale.reservations, days=HISTORY_DAYS, seed=seed, occupancy=0,
+                       email_domain=EMAIL_DOMAIN, lot_prefix=LOT_PREFIX, password=PASSWORD)
+    return Fixture(admin_email, seeded.user_emails, seeded.lot_ids)
+
+
+# ---------------------------------------------------- SCENARIOS ----------------------------------------------------
+
+# One benchmarked endpoint. `role` is who sends it ('user', 'admin', or None
+# for anonymous); request(fixture, session, i) gives the (method, path, form)
+# of its i-th request; a response is good when its status is 200, or a redirect
+# to `redirects_to` (an endpoint) when that is given.
+Scenario = namedtuple('Scenario', 'endpoint role request redirects_to')
+
+
+def _get(endpoint, **values):
+    return lambda fixture, session, i: ('GET', url_for(endpoint, **values), None)
+
+
+def _login(fixture, session, i):
+    return 'POST', url_for('auth.login_post'), {'email': fixture.user_emails[i % len(fixture.user_emails)],
+                                                 'password': PASSWORD}
+
+
+def _book(fixture, session, i):
+    lot_id = fixture.lot_ids[i % len(fixture.lot_ids)]
+    return 'POST', url_for('user.book_spot', lot_id=lot_id), {'spot_id': 'any', 'plate_number': session.plate}
+
+
+def _release(fixture, session, i):
+    return 'POST', url_for('user.release_reservation', res_id=session.active.pop()), None
+
+
+SCENARIOS = [
+    Scenario('auth.login_post', None, _login, 'user.index'),
+    Scenario('user.new_booking', 'user', _get('user.new_booking'), None),
+    Scenario('user.book_spot', 'user', _book, 'user.user_info'),
+    Scenario('user.release_reservation', 'user', _release, 'user.user_info'),
+    Scenario('admin.index', 'admin', _get('admin.index'), None),
+    Scenario('admin.summary', 'admin', _get('admin.summary'), None),
+    Scenario('admin.view_reservations', 'admin', _get('admin.view_reservations'), None),
+]
+
+
+# ----------------------------------------------------- CLIENTS -----------------------------------------------------
+
+def _url(endpoint, **values):
+    with app.test_request_context():
+        return url_for(endpoint, **values)
+
+
+# Run target(*args) for each args in `jobs`, all at once when `parallel`.
+# Always in fresh threads: a test client request made where an app context is
+# already active (as in a CLI command) would share that context's g and
+# database session instead of getting its own.
+def _in_threads(target, jobs, parallel):
+    threads = [threading.Thread(target=target, args=args) for args in jobs]
+    for thread in threads:
+        thread.start()
+        if not parallel:
+            thread.join()
+    for thread in threads:
+        thread.join()
+
+
+# A simulated browser. It keeps the session cookie it got at login and ignores
+# later ones, which would only add flash messages nobody reads.
+class _Session:
+    def __init__(self, email=None):
+        self.email = email
+        self.cookie = None
+        self.plate = None
+        self.active = []
+
+    def login(self):
+        status, location, cookie = self.send('POST', _url('auth.login_post'),
+                                             {'email': self.email, 'password': PASSWORD})
+        self.cookie = (cookie or '').split(';')[0]
+        return status
+
+    def close(self):
+        pass
+
+
+class TestClientSession(_Session):
+    def __init__(self, email=None):
+        super().__init__(email)
+        self.client = app.test_client(use_cookies=False)
+
+    def send(self, method, path, form=None):
+        response = self.client.open(path, method=method, data=form,
+                                    headers={'Cookie': self.cookie} if self.cookie else {})
+        response.close()
+        return response.status_code, response.headers.get('Location'), response.headers.get('Set-Cookie')
+
+
+class HttpSession(_Session):
+    def __init__(self, port, email=None):
+        super().__init__(email)
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+
+    def send(self, method, path, form=None):
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        self.connection.request(method, path, body=body, headers=headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status, response.getheader('Location'), response.getheader('Set-Cookie')
+
+    def close(self):
+        self.connection.close()
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+# Serve the app on a free local port from a background thread. Returns the
+# server (call shutdown() when done) and its port.
+def local_server():
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.socket.getsockname()[1]
+
+
+# --------------------------------------------------- MEASUREMENT ---------------------------------------------------
+
+# SQL statements per request, by endpoint, counted in the request's own context
+_queries = defaultdict(list)
+_queries_lock = threading.Lock()
+_counting = False
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.bench_queries = g.get('bench_queries', 0) + 1
+
+
+def _record_queries(sender, response, **extra):
+    with _queries_lock:
+        _queries[request.endpoint].append(g.get('bench_queries', 0))
+
+
+def _start_counting():
+    global _counting
+    if not _counting:
+        event.listen(db.engine, 'before_cursor_execute', _count_statement)
+        request_finished.connect(_record_queries, app)
+        _counting = True
+    _queries.clear()
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(len(ordered) * p / 100) - 1, 0)]
+
+
+# Send `total` requests of `scenario`, shared out over `sessions`, running the
+# sessions in parallel threads when `parallel`
+def _run_scenario(scenario, fixture, sessions, total, parallel):
+    expected = _url(scenario.redirects_to) if scenario.redirects_to else None
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def run(session, count, offset):
+        spent, failed = [], 0
+        with app.test_request_context():
+            planned = [scenario.request(fixture, session, offset + n) for n in range(count)]
+        for method, path, form in planned:
+            started = time.perf_counter()
+            status, location, _ = session.send(method, path, form)
+            spent.append(time.perf_counter() - started)
+            if expected:
+                failed += not (status in (301, 302, 303) and location and location.endswith(expected))
+            else:
+                failed += status != 200
+        with lock:
+            latencies.extend(spent)
+            failures.append(failed)
+
+    shares = [total // len(sessions) + (i < total % len(sessions)) for i in range(len(sessions))]
+    if scenario.endpoint == 'user.release_reservation':
+        shares = [min(share, len(session.active)) for share, session in zip(shares, sessions)]
+    jobs = [(session, share, sum(shares[:i])) for i, (session, share) in enumerate(zip(sessions, shares)) if share]
+
+    started = time.perf_counter()
+    _in_threads(run, jobs, parallel)
+    elapsed = time.perf_counter() - started
+
+    queries = _queries.get(scenario.endpoint, [])
+    return {
+        'requests': len(latencies),
+        'errors': sum(failures),
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else 0.0,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else 0.0,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else 0.0,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'queries': sum(queries) / len(queries) if queries else 0.0,
+    }
+
+
+# Run every scenario once in `mode` ('client' or 'http') with `users`
+# simulated users. Returns {endpoint: result}.
+def run_suite(fixture, mode, requests, users):
+    server = None
+    if mode == 'http':
+        server, port = local_server()
+        make_session = lambda email=None: HttpSession(port, email)
+    else:
+        make_session = TestClientSession
+    parallel = mode == 'http'
+
+    sessions = {
+        'user': [make_session(email) for email in fixture.user_emails[:users]],
+        'admin': [make_session(fixture.admin_email) for _ in range(users)],
+        None: [make_session() for _ in range(users)],
+    }
+    user_sessions = sessions['user']
+    _in_threads(lambda session: session.login(), [(session,) for session in user_sessions + sessions['admin']],
+                parallel)
+    plates = dict(db.session.execute(
+        select(User.email, Vehicle.plate_number).join(Vehicle, Vehicle.user_id == User.id)
+        .where(User.email.in_(fixture.user_emails[:users]))
+    ).all())
+    for session in user_sessions:
+        session.plate = plates[session.email]
+
+    results = {}
+    try:
+        for scenario in SCENARIOS:
+            if scenario.endpoint == 'user.release_reservation':
+                # Release what the booking scenario booked
+                active = db.session.execute(
+                    select(User.email, Reservation.id).join(User, Reservation.user_id == User.id)
+                    .where(Reservation.status == 'Active', User.email.in_(fixture.user_emails[:users]))
+                ).all()
+                db.session.rollback()
+                for session in user_sessions:
+                    session.active = [res_id for email, res_id in active if email == session.email]
+            _start_counting()
+            results[scenario.endpoint] = _run_scenario(scenario, fixture, sessions[scenario.role], requests, parallel)
+    finally:
+        for role_sessions in sessions.values():
+            for session in role_sessions:
+                session.close()
+        if server:
+            server.shutdown()
+    return results
+
+
+# ---------------------------------------------------- BASELINES ----------------------------------------------------
+
+def save_baseline(path, meta, results):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# Compare `results` ({mode: {endpoint: result}}) with a saved baseline. Returns
+# [(mode, endpoint, metric, baseline, current, change %, regressed)]. p95 latency
+# and throughput regress when worse by more than `tolerance` percent, query
+# counts when they grow at all; p50/p99 are shown but too noisy to judge by.
+def compare(baseline, results, tolerance):
+    rows = []
+    for mode, endpoints in results.items():
+        for endpoint, current in endpoints.items():
+            before = baseline['results'].get(mode, {}).get(endpoint)
+            if not before:
+                continue
+            for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries'):
+                old, new = before[metric], current[metric]
+                change = (new - old) / old * 100 if old else 0.0
+                if metric == 'queries':
+                    regressed = new > old + 1e-9
+                elif metric == 'rps':
+                    regressed = change < -tolerance
+                else:
+                    regressed = metric == 'p95_ms' and change > tolerance
+                rows.append((mode, endpoint, metric, old, new, change, regressed))
+    return rows
@@ -0,0 +1,156 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app import app
+from models import db, User, ParkingLot, ParkingSpot, Reservation
+
+try:
+    import numpy as np
+except ImportError:  # required (requirements.txt); without it batch_costs is the scalar loop
+    np = None
+
+
+# The one place a reservation's cost is worked out.
+#
+# Pricing rule: parked time rounded up to whole hours (at least one) times the
+# lot's hourly rate, rounded half-up to the paisa. Expired reservations add the
+# hours past their booked end at OVERSTAY_MULTIPLIER times the rate.
+#
+# The scalar functions and batch_costs() do the same float operations in the
+# same order, so both give identical amounts (see `flask check-billing`).
+
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_paise(amount):
+    return math.floor(amount * 100 + 0.5) / 100
+
+
+def billable_hours(start_time, end_time):
+    seconds = (end_time - start_time) // _MICROSECOND / 1e6
+    return max(math.ceil(seconds / 3600), 1)
+
+
+def reservation_cost(start_time, end_time, rate):
+    return _to_paise(billable_hours(start_time, end_time) * rate)
+
+
+# What an Active reservation would cost if released at `now`
+def estimate_cost(reservation, now=None):
+    return reservation_cost(reservation.start_time, now or datetime.utcnow(), reservation.spot.lot.price_per_hour)
+
+
+# Cost of a reservation expired at `expired_at` that was booked until `booked_end`
+def expiry_cost(start_time, booked_end, expired_at, rate):
+    # Older bookings stored an end a few microseconds past the whole hour
+    booked = max(math.ceil(round((booked_end - start_time) // _MICROSECOND / 1e6 / 3600, 2)), 1)
+    overstay = 0
+    if expired_at > booked_end:
+        overstay = math.ceil((expired_at - booked_end) // _MICROSECOND / 1e6 / 3600)
+    return _to_paise(booked * rate + overstay * rate * app.config['OVERSTAY_MULTIPLIER'])
+
+
+# reservation_cost over parallel sequences of start times, end times and rates
+# (lists of datetimes, or datetime64 arrays). Vectorized with NumPy when it is
+# installed. Returns a list of floats.
+def batch_costs(starts, ends, rates):
+    if np is None:
+        return [reservation_cost(start, end, rate) for start, end, rate in zip(starts, ends, rates)]
+    if isinstance(starts, np.ndarray) and isinstance(ends, np.ndarray):
+        microseconds = (ends.astype('datetime64[us]') - starts.astype('datetime64[us]')).astype(np.int64)
+    else:
+        # Converting datetime objects to datetime64 is slower than one subtraction each
+        microseconds = np.fromiter(((end - start) // _MICROSECOND for start, end in zip(starts, ends)),
+                                   dtype=np.int64, count=len(starts))
+    hours = np.maximum(np.ceil(microseconds / 1e6 / 3600), 1)
+    return (np.floor(hours * np.asarray(rates, dtype=np.float64) * 100 + 0.5) / 100).tolist()
+
+
+# ---------------------------------------------------- RE-BILLING ----------------------------------------------------
+
+REBILL_BATCH = 50000
+
+
+# Recompute final_cost at the lots' current rates for every Released/Completed
+# reservation, `batch_size` rows at a time, writing back only the ones that
+# changed (nothing with dry_run). Expired ones are left alone: their booked end
+# time is overwritten when they expire.
+# Returns (reservations checked, reservations changed, user ids affected).
+def rebill(batch_size=REBILL_BATCH, dry_run=False):
+    checked, changed, changed_users = 0, 0, set()
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(Reservation.id, Reservation.user_id, Reservation.start_time, Reservation.end_time,
+                   Reservation.final_cost, ParkingLot.price_per_hour)
+            .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+            .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+            .where(Reservation.id > last_id, Reservation.status.in_(('Released', 'Completed')),
+                   Reservation.end_time.isnot(None))
+            .order_by(Reservation.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return checked, changed, changed_users
+        costs = batch_costs([row.start_time for row in rows], [row.end_time for row in rows],
+                            [row.price_per_hour for row in rows])
+        differing = [(row, cost) for row, cost in zip(rows, costs) if row.final_cost != cost]
+        if differing and not dry_run:
+            db.session.execute(update(Reservation), [{'id': row.id, 'final_cost': cost} for row, cost in differing])
+            db.session.commit()
+        checked += len(rows)
+        changed += len(differing)
+        changed_users.update(row.user_id for row, _ in differing)
+        last_id = rows[-1].id
+
+
+# ----------------------------------------------------- INVOICES -----------------------------------------------------
+
+def _month_bounds(year, month):
+    first = datetime(year, month, 1)
+    following = datetime(year + month // 12, month % 12 + 1, 1)
+    return first, following
+
+
+# Invoices for reservations ended in the given month, for one user or all of
+# them, from a single query. Returns {user_id: invoice} where an invoice has
+# the user's name/email, 'lines' (one per reservation) and 'total'.
+def monthly_invoices(year, month, user_id=None):
+    first, following = _month_bounds(year, month)
+    query = (
+        select(Reservation.id, Reservation.user_id, Reservation.vehicle_plate, Reservation.status,
+               Reservation.start_time, Reservation.end_time, Reservation.final_cost,
+               ParkingSpot.spot_number, ParkingLot.name.label('lot_name'), ParkingLot.price_per_hour,
+               User.full_name, User.email)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .join(User, Reservation.user_id == User.id)
+        .where(Reservation.status != 'Active', Reservation.end_time >= first, Reservation.end_time < following)
+        .order_by(Reservation.user_id, Reservation.end_time)
+    )
+    if user_id is not None:
+        query = query.where(Reservation.user_id == user_id)
+
+    invoices = defaultdict(lambda: {'lines': [], 'total': 0.0})
+    for row in db.session.execute(query):
+        invoice = invoices[row.user_id]
+        invoice.update(full_name=row.full_name, email=row.email, year=year, month=month)
+        amount = row.final_cost or 0.0
+        invoice['lines'].append({
+            'reservation_id': row.id,
+            'lot': row.lot_name,
+            'spot': row.spot_number,
+            'vehicle_plate': row.vehicle_plate,
+            'status': row.status,
+            'start_time': row.start_time,
+            'end_time': row.end_time,
+            'hours': billable_hours(row.start_time, row.end_time),
+            'rate': row.price_per_hour,
+            'amount': amount,
+        })
+        invoice['total'] = _to_paise(invoice['total'] + amount)
+    return dict(invoices)
+
+
+def monthly_invoice(user_id, year, month):
+    return monthly_invoices(year, month, user_id).get(user_id)
@@ -0,0 +1,705 @@
+import click
+from app import app
+from occupancy import reconcile_lot_counts
+
+
+# flask reconcile-counts: recompute lot spot counters from ParkingSpot
+@app.cli.command('reconcile-counts')
+@click.option('--dry-run', is_flag=True, help='Only report drift, do not fix it.')
+def reconcile_counts(dry_run):
+    """Recompute lot spot counters, report drift."""
+    drift = reconcile_lot_counts(fix=not dry_run)
+    if not drift:
+        click.echo('Lot counters are consistent.')
+        return
+    for row in drift:
+        click.echo(f"lot {row['lot_id']}: {row['column']} stored={row['stored']} actual={row['actual']}")
+    click.echo(f"{len(drift)} counter(s) {'drifted' if dry_run else 'fixed'}.")
+
+
+# flask stress-allocation: hammer the allocator from many threads and check
+# that no spot is ever handed out twice
+@app.cli.command('stress-allocation')
+@click.option('--spots', default=500, help='Spots in the scratch lot.')
+@click.option('--threads', default=16, help='Concurrent booking threads.')
+def stress_allocation(spots, threads):
+    """Check the allocator for double bookings."""
+    import threading
+    import time
+    from collections import Counter
+    from models import db, Address, ParkingLot, ParkingSpot
+    from allocation import claim_spot
+    from provisioning import remove_lot
+
+    address = Address(address='stress test', city='-', state='-', pincode='000000')
+    db.session.add(address)
+    db.session.flush()
+    lot = ParkingLot(name='stress-allocation', price_per_hour=0, max_spots=spots,
+                     address_id=address.id, available_count=spots)
+    db.session.add(lot)
+    db.session.flush()
+    db.session.add_all([ParkingSpot(spot_number=str(i), lot_id=lot.id) for i in range(1, spots + 1)])
+    db.session.commit()
+    lot_id, first_spot = lot.id, ParkingSpot.query.filter_by(lot_id=lot.id).first().id
+
+    claimed = []
+    errors = []
+    contested = []
+
+    def worker():
+        with app.app_context():
+            # Everyone races for the same spot first: exactly one may win
+            if claim_spot(lot_id, first_spot):
+                contested.append(first_spot)
+            db.session.commit()
+            while True:
+                try:
+                    spot_id = claim_spot(lot_id)
+                    db.session.commit()
+                except Exception as exc:
+                    db.session.rollback()
+                    errors.append(exc)
+                    continue
+                if spot_id is None:
+                    if ParkingSpot.query.filter_by(lot_id=lot_id, status='A').count() == 0:
+                        break
+                    continue
+                claimed.append(spot_id)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    claimed.extend(contested)
+    doubles = [spot for spot, n in Counter(claimed).items() if n > 1]
+    lot = db.session.get(ParkingLot, lot_id)
+    db.session.refresh(lot)
+    click.echo(f'{db.engine.dialect.name}: {len(claimed)} bookings by {threads} threads in {elapsed:.2f}s '
+               f'({len(claimed) / elapsed:.0f}/s), {len(errors)} retried errors')
+    click.echo(f'contested spot winners: {len(contested)}, double bookings: {len(doubles)}, '
+               f'counters: available={lot.available_count} occupied={lot.occupied_count}')
+
+    remove_lot(lot_id)
+    db.session.delete(address)
+    db.session.commit()
+    if doubles or len(contested) != 1 or len(claimed) != spots:
+        raise click.ClickException('Allocation stress test FAILED')
+    click.echo('Allocation stress test passed.')
+
+
+# flask verify-spot-index: load every lot's free-spot index (spot_index.py) as a
+# worker would and check it against ParkingSpot and the lot's available_count
+@app.cli.command('verify-spot-index')
+def verify_spot_index():
+    """Check the free-spot index against the DB."""
+    from sqlalchemy import select
+    from models import db, ParkingLot
+    from spot_index import get_lot_index, verify_lot_index
+
+    lots = db.session.execute(select(ParkingLot.id, ParkingLot.available_count).order_by(ParkingLot.id)).all()
+    inconsistent = 0
+    for lot_id, available in lots:
+        index = get_lot_index(lot_id)
+        if index is None:
+            raise click.ClickException('The free-spot index is disabled (SPOT_INDEX_ENABLED).')
+        mismatched = verify_lot_index(lot_id)
+        if mismatched:
+            click.echo(f'lot {lot_id}: spots {", ".join(map(str, mismatched))} disagree with the database')
+        elif index.count_free() != available:
+            click.echo(f'lot {lot_id}: index has {index.count_free()} free spots, available_count {available}')
+        else:
+            continue
+        inconsistent += 1
+    if inconsistent:
+        raise click.ClickException(f'{inconsistent} of {len(lots)} lot(s) inconsistent')
+    click.echo(f'Free-spot index matches the database for {len(lots)} lot(s).')
+
+
+# flask backfill-rollups: rebuild the daily rollup tables from history
+@app.cli.command('backfill-rollups')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Only rebuild days from this date (YYYY-MM-DD) onwards.')
+def backfill_rollups_command(since):
+    """Rebuild the daily rollups from history."""
+    from rollups import backfill_rollups
+    written = backfill_rollups(since.date() if since else None)
+    for table, rows in written.items():
+        click.echo(f'{table}: {rows} row(s) written')
+
+
+# flask upgrade-db: add missing tables, columns and indexes to an existing database
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Add missing tables, columns and indexes."""
+    from migrations import upgrade_schema
+    changes = upgrade_schema()
+    for change in changes:
+        click.echo(f'added {change}')
+    click.echo('Database is up to date.' if not changes else f'{len(changes)} change(s) applied.')
+
+
+# flask check-query-plans: fail if a hot query would scan a whole table
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot query scans a whole table."""
+    from query_plans import check_query_plans, hot_queries
+    failures = check_query_plans()
+    for name in hot_queries():
+        click.echo(f"{'FULL SCAN' if name in failures else 'ok':>9}  {name}")
+        for line in failures.get(name, []):
+            click.echo(f'           {line}')
+    if failures:
+        raise click.ClickException(f'{len(failures)} hot query(ies) fall back to a full table scan')
+
+
+
+# flask check-dashboard-queries: the admin dashboard must take the same number
+# of SQL statements however many lots there are
+@app.cli.command('check-dashboard-queries')
+@click.option('--lots', default=20, help='Scratch lots added for the second count.')
+def check_dashboard_queries(lots):
+    """Fail if dashboard queries grow with lots."""
+    from sqlalchemy import event
+    from models import db, Address, ParkingLot, ParkingSpot
+    from provisioning import remove_lot
+    from stats import dashboard_snapshot
+
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def measure():
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            dashboard_snapshot()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return len(statements)
+
+    before = measure()
+    address = Address(address='dashboard query check', city='-', state='-', pincode='000000')
+    db.session.add(address)
+    db.session.flush()
+    scratch = [ParkingLot(name=f'dashboard-check-{i}', price_per_hour=0, max_spots=2, address_id=address.id,
+                          available_count=2) for i in range(lots)]
+    db.session.add_all(scratch)
+    db.session.flush()
+    db.session.add_all([ParkingSpot(spot_number=str(n), lot_id=lot.id) for lot in scratch for n in (1, 2)])
+    db.session.commit()
+    try:
+        after = measure()
+    finally:
+        for lot in scratch:
+            remove_lot(lot.id)
+        db.session.delete(address)
+        db.session.commit()
+
+    click.echo(f'{before} statement(s) before, {after} with {lots} more lot(s)')
+    if after > before:
+        raise click.ClickException('The dashboard query count grows with the number of lots')
+    click.echo('Dashboard query count is constant.')
+
+# flask bench-export: time the reservation export against the current data,
+# optionally tracing its peak Python memory (which slows it down)
+@app.cli.command('bench-export')
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--trace-memory', is_flag=True, help='Report peak Python memory.')
+def bench_export(export_format, trace_memory):
+    """Time the reservation export."""
+    import time
+    import tracemalloc
+    from models import User
+
+    admin = User.query.filter_by(is_admin=True).first()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = admin.id
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(f'/admin/reservations/export?format={export_format}', buffered=False)
+    rows = size = 0
+    for chunk in response.response:
+        size += len(chunk)
+        rows += chunk.count(b'\n')
+    elapsed = time.perf_counter() - started
+
+    if export_format == 'csv':
+        rows -= 1
+    click.echo(f'{rows} rows, {size / 1e6:.1f} MB in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s)')
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        click.echo(f'peak Python memory {peak / 1e6:.1f} MB')
+
+
+# flask bench-db: concurrent readers and writers against each engine profile.
+# SQLite runs on a scratch file per profile; server databases use a scratch
+# table in the configured database.
+@app.cli.command('bench-db')
+@click.option('--readers', default=8, help='Reader threads.')
+@click.option('--writers', default=4, help='Writer threads.')
+@click.option('--seconds', default=5.0, help='How long each profile runs.')
+@click.option('--profile', 'profiles', multiple=True, help='Profile(s) to run; default all.')
+def bench_db(readers, writers, seconds, profiles):
+    """Benchmark concurrent DB readers and writers."""
+    import os
+    import tempfile
+    import threading
+    import time
+    from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, func, insert, select
+    from sqlalchemy.engine import make_url
+    from engine_profile import PROFILES, configure_engine, engine_options
+
+    configured = app.config['SQLALCHEMY_DATABASE_URI']
+    on_sqlite = make_url(configured).get_backend_name() == 'sqlite'
+    scratch_dir = tempfile.mkdtemp() if on_sqlite else None
+
+    for profile in profiles or PROFILES:
+        uri = f'sqlite:///{os.path.join(scratch_dir, profile + ".db")}' if on_sqlite else configured
+        engine = create_engine(uri, **engine_options(uri, profile))
+        configure_engine(engine, profile)
+        metadata = MetaData()
+        table = Table('bench_db_rows', metadata,
+                      Column('id', Integer, primary_key=True),
+                      Column('bucket', Integer, index=True),
+                      Column('payload', String(100)))
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(table), [{'bucket': i % 100, 'payload': 'x' * 50} for i in range(10000)])
+
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        latencies = {'reads': [], 'writes': []}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def run(kind, n):
+            done, errors, spent = 0, 0, []
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    with engine.begin() as conn:
+                        if kind == 'writes':
+                            conn.execute(insert(table).values(bucket=n % 100, payload='y' * 50))
+                        else:
+                            conn.execute(select(func.count()).where(table.c.bucket == n % 100)).scalar()
+                except Exception:
+                    errors += 1
+                    continue
+                spent.append(time.perf_counter() - started)
+                done += 1
+                n += 1
+            with lock:
+                counts[kind] += done
+                counts['errors'] += errors
+                latencies[kind].extend(spent)
+
+        threads = [threading.Thread(target=run, args=('reads', i)) for i in range(readers)]
+        threads += [threading.Thread(target=run, args=('writes', i)) for i in range(writers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        def p95(values):
+            return sorted(values)[int(len(values) * 0.95)] * 1000 if values else 0.0
+
+        click.echo(f"{profile:12} {engine.dialect.name}: {counts['reads'] / seconds:8.0f} reads/s "
+                   f"(p95 {p95(latencies['reads']):.1f} ms)  {counts['writes'] / seconds:7.0f} writes/s "
+                   f"(p95 {p95(latencies['writes']):.1f} ms)  {counts['errors']} errors")
+        metadata.drop_all(engine)
+        engine.dispose()
+
+
+# flask bench-provisioning: time creating lots of growing size; the time per
+# spot should stay flat as lots grow
+@app.cli.command('bench-provisioning')
+@click.option('--sizes', default='1000,5000,20000', help='Comma-separated lot sizes.')
+def bench_provisioning(sizes):
+    """Time creating lots of growing size."""
+    import time
+    from models import db, Address, ParkingLot, ParkingSpot
+    from provisioning import provision_spots, remove_lot
+
+    for size in [int(size) for size in sizes.split(',')]:
+        started = time.perf_counter()
+        address = Address(address='provisioning bench', city='-', state='-', pincode='000000')
+        db.session.add(address)
+        db.session.flush()
+        lot = ParkingLot(name='bench-provisioning', price_per_hour=0, max_spots=size,
+                         address_id=address.id, rows_per_level=20, bays_per_row=50)
+        db.session.add(lot)
+        db.session.flush()
+        provision_spots(lot, size)
+        db.session.commit()
+        elapsed = time.perf_counter() - started
+
+        stored = ParkingSpot.query.filter_by(lot_id=lot.id).count()
+        click.echo(f'{size:7} spots: {elapsed:6.2f}s ({elapsed / size * 1e6:5.1f} us/spot), '
+                   f'{stored} stored, available_count={lot.available_count}')
+
+        remove_lot(lot.id)
+        db.session.delete(address)
+        db.session.commit()
+
+
+# flask expire-reservations: expire overdue Active reservations once, or keep
+# sweeping every --interval seconds with --loop (run it as a worker process)
+@app.cli.command('expire-reservations')
+@click.option('--loop', is_flag=True, help='Keep sweeping until interrupted.')
+@click.option('--interval', type=int, default=None, help='Seconds between sweeps (default EXPIRY_INTERVAL).')
+@click.option('--batch-size', type=int, default=None, help='Reservations per batch (default EXPIRY_BATCH_SIZE).')
+@click.option('--budget-ms', type=int, default=None, help='Stop a sweep after this long (default EXPIRY_SWEEP_BUDGET_MS).')
+def expire_reservations(loop, interval, batch_size, budget_ms):
+    """Expire overdue Active reservations."""
+    import time
+    from models import db
+    from expiry import sweep
+
+    interval = interval or app.config['EXPIRY_INTERVAL']
+    while True:
+        try:
+            report = sweep(batch_size=batch_size, budget_ms=budget_ms)
+        except Exception as exc:
+            db.session.rollback()
+            if not loop:
+                raise
+            app.logger.exception('Expiry sweep failed: %s', exc)
+        else:
+            slowest = max(report['batch_ms'], default=0.0)
+            click.echo(f"expired {report['expired']} in {report['batches']} batch(es), "
+                       f"{report['elapsed_ms']:.1f} ms (slowest batch {slowest:.1f} ms)"
+                       + (', budget exhausted' if report['budget_exhausted'] else ''))
+        if not loop:
+            return
+        db.session.remove()
+        time.sleep(interval)
+
+
+# flask check-billing: the scalar and batch billing paths must agree to the paisa
+@app.cli.command('check-billing')
+@click.option('--samples', default=100000, help='Random reservations to compare.')
+@click.option('--limit', default=100000, help='Stored reservations to compare.')
+def check_billing(samples, limit):
+    """Fail if scalar and batch billing disagree."""
+    import random
+    from datetime import datetime, timedelta
+    from sqlalchemy import select
+    from models import db, ParkingLot, ParkingSpot, Reservation
+    import billing
+
+    rng = random.Random(42)
+    base = datetime(2025, 1, 1)
+    starts, ends, rates = [], [], []
+    for _ in range(samples):
+        start = base + timedelta(seconds=rng.randrange(0, 365 * 86400), microseconds=rng.randrange(0, 10 ** 6))
+        # include exact-hour and sub-second stays, where rounding up matters most
+        length = rng.choice([timedelta(hours=rng.randrange(0, 48)),
+                             timedelta(microseconds=rng.randrange(0, 10 ** 6)),
+                             timedelta(seconds=rng.randrange(0, 72 * 3600), microseconds=rng.randrange(0, 10 ** 6))])
+        starts.append(start)
+        ends.append(start + length)
+        rates.append(rng.choice([10, 12.5, 19.99, 20, 33.33, 0.01, rng.uniform(0, 500)]))
+
+    stored = db.session.execute(
+        select(Reservation.start_time, Reservation.end_time, ParkingLot.price_per_hour)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .where(Reservation.end_time.isnot(None)).limit(limit)
+    ).all()
+    for row in stored:
+        starts.append(row.start_time)
+        ends.append(row.end_time)
+        rates.append(row.price_per_hour)
+
+    if billing.np is None:
+        raise click.ClickException('numpy is not installed, so the batch path would be the scalar one '
+                                   'compared with itself (pip install -r requirements.txt)')
+    batched = billing.batch_costs(starts, ends, rates)
+    mismatches = [(start, end, rate, billing.reservation_cost(start, end, rate), cost)
+                  for start, end, rate, cost in zip(starts, ends, rates, batched)
+                  if billing.reservation_cost(start, end, rate) != cost]
+    click.echo(f'{len(starts)} reservations ({samples} random, {len(stored)} stored) compared')
+    for start, end, rate, scalar, batch in mismatches[:10]:
+        click.echo(f'  {start} -> {end} @ {rate}: scalar {scalar} batch {batch}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} mismatch(es) between scalar and batch billing')
+    click.echo('Scalar and batch billing agree.')
+
+
+# flask rebill: recompute stored costs with the current pricing rule and rates
+@app.cli.command('rebill')
+@click.option('--apply', is_flag=True, help='Write the new costs (default: only report).')
+@click.option('--batch-size', default=50000, help='Reservations per batch.')
+def rebill_command(apply, batch_size):
+    """Recompute stored costs with current pricing."""
+    import time
+    from billing import rebill
+    from rollups import backfill_rollups
+    from stats import invalidate_user_stats
+
+    started = time.perf_counter()
+    checked, changed, users = rebill(batch_size=batch_size, dry_run=not apply)
+    click.echo(f'{checked} reservation(s) checked in {time.perf_counter() - started:.1f}s, '
+               f'{changed} {"re-billed" if apply else "would change"} for {len(users)} user(s).')
+    if apply and changed:
+        backfill_rollups()
+        invalidate_user_stats(*users)
+        click.echo('Daily rollups rebuilt.')
+
+
+# flask invoices: monthly invoices per user, printed or written as CSV files
+@app.cli.command('invoices')
+@click.option('--month', required=True, type=click.DateTime(formats=['%Y-%m']), help='Month as YYYY-MM.')
+@click.option('--user-id', type=int, default=None, help='Only this user.')
+@click.option('--out', type=click.Path(file_okay=False), default=None, help='Write one CSV per user here.')
+def invoices_command(month, user_id, out):
+    """Print or write monthly invoices per user."""
+    import csv
+    import os
+    from billing import monthly_invoices
+
+    invoices = monthly_invoices(month.year, month.month, user_id)
+    if out:
+        os.makedirs(out, exist_ok=True)
+    for uid, invoice in invoices.items():
+        click.echo(f"{uid:6} {invoice['email']:30} {len(invoice['lines']):4} reservation(s)  {invoice['total']:10.2f}")
+        if out:
+            path = os.path.join(out, f'invoice-{month:%Y-%m}-user-{uid}.csv')
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(invoice['lines'][0]))
+                writer.writeheader()
+                writer.writerows(invoice['lines'])
+    click.echo(f'{len(invoices)} invoice(s), total {sum(i["total"] for i in invoices.values()):.2f}')
+
+
+# flask seed: bulk-generate deterministic, realistic data (see seed.py); best
+# on a fresh database, e.g. SQLALCHEMY_DATABASE_URI=sqlite:///seed.sqlite3
+@app.cli.command('seed')
+@click.option('--users', default=10_000, help='Users, each with an address and vehicle(s).')
+@click.option('--lots', default=50, help='Parking lots.')
+@click.option('--spots-per-lot', default=2_000, help='Spots in each lot.')
+@click.option('--reservations', default=1_000_000, help='Finished reservations in the history.')
+@click.option('--days', default=365, help='Days of history.')
+@click.option('--seed', 'random_seed', default=0, help='Random seed; same seed, same data.')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d %H:%M', '%Y-%m-%d']), default=None,
+              help='Where the history ends (default now); fix it for identical data across days.')
+@click.option('--occupancy', default=0.3, help='Share of spots held by Active reservations.')
+@click.option('--password', default='password', help='Password of every generated user.')
+def seed_command(users, lots, spots_per_lot, reservations, days, random_seed, until, occupancy, password):
+    """Generate deterministic bulk data."""
+    import time
+    from models import db, User
+    from seed import seed
+
+    domain = '@seed.example'
+    if db.session.query(User.id).filter(User.email.like('%' + domain)).first():
+        raise click.ClickException(f'This database already has generated users ({domain}); seed a fresh one.')
+
+    started = time.perf_counter()
+    seeded = seed(users=users, lots=lots, spots_per_lot=spots_per_lot, reservations=reservations, days=days,
+                  seed=random_seed, until=until, occupancy=occupancy, email_domain=domain, password=password)
+    click.echo(f'{len(seeded.user_emails)} users, {len(seeded.lot_ids)} lots of {spots_per_lot} spots, '
+               f'{seeded.reservations} past and {seeded.active} active reservations '
+               f'in {time.perf_counter() - started:.1f}s')
+    if seeded.user_emails:
+        click.echo(f'Log in as e.g. {seeded.user_emails[0]} / {password}')
+
+
+# flask bench: latency, throughput and SQL statements per request for the
+# booking flow endpoints, through the test client and/or over local HTTP, on a
+# bench fixture of the given scale; optionally saved as or compared with a
+# baseline. Run it against a scratch database (see benchmarks.py).
+@app.cli.command('bench')
+@click.option('--scale', type=click.Choice(['small', 'medium', 'large']), default='small', help='Fixture size.')
+@click.option('--mode', 'modes', type=click.Choice(['client', 'http']), multiple=True,
+              help='Test client and/or HTTP load; default both.')
+@click.option('--requests', default=200, help='Requests per endpoint.')
+@click.option('--users', default=8, help='Simulated users (client threads in HTTP mode).')
+@click.option('--seed', default=0, help='Random seed for the fixture.')
+@click.option('--keep', is_flag=True, help='Leave the fixture in the database.')
+@click.option('--save-baseline', type=click.Path(dir_okay=False), default=None, help='Write the results here.')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Compare with a saved baseline.')
+@click.option('--tolerance', default=20.0, help='Allowed latency/throughput change vs the baseline, in %.')
+def bench_command(scale, modes, requests, users, seed, keep, save_baseline, baseline, tolerance):
+    """Benchmark the booking flow endpoints."""
+    import time
+    from benchmarks import (SCALES, build_fixture, compare, load_baseline, remove_fixture, run_suite,
+                            save_baseline as write_baseline)
+    from models import db
+
+    remove_fixture()
+    started = time.perf_counter()
+    fixture = build_fixture(SCALES[scale], seed)
+    click.echo(f'{scale} fixture {SCALES[scale]} built in {time.perf_counter() - started:.1f}s')
+
+    results = {}
+    try:
+        for mode in modes or ('client', 'http'):
+            results[mode] = run_suite(fixture, mode, requests, users)
+            click.echo(f'\n{mode} ({users} user(s), {requests} requests per endpoint)')
+            click.echo(f"{'endpoint':26} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} errors")
+            for endpoint, r in results[mode].items():
+                click.echo(f"{endpoint:26} {r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f} "
+                           f"{r['rps']:8.1f} {r['queries']:8.1f} {r['errors']:6}")
+    finally:
+        if not keep:
+            remove_fixture()
+
+    meta = {'scale': scale, 'requests': requests, 'users': users, 'seed': seed,
+            'database': db.engine.dialect.name}
+    if save_baseline:
+        write_baseline(save_baseline, meta, results)
+        click.echo(f'\nBaseline written to {save_baseline}')
+    if baseline:
+        saved = load_baseline(baseline)
+        if saved['meta'] != meta:
+            click.echo(f"\nwarning: baseline was taken with {saved['meta']}")
+        rows = compare(saved, results, tolerance)
+        click.echo(f"\n{'mode':6} {'endpoint':26} {'metric':8} {'baseline':>9} {'now':>9} {'change':>8}")
+        for mode, endpoint, metric, old, new, change, regressed in rows:
+            click.echo(f"{mode:6} {endpoint:26} {metric:8} {old:9.1f} {new:9.1f} {change:+7.1f}%"
+                       f"{'  REGRESSION' if regressed else ''}")
+        regressions = sum(row[-1] for row in rows)
+        if regressions:
+            raise click.ClickException(f'{regressions} metric(s) regressed beyond the baseline')
+        click.echo('No regressions against the baseline.')
+
+
+# flask bench-sse: CPU used by idle /api/events subscribers, and how long one
+# published change takes to reach all of them, over a local HTTP server
+@app.cli.command('bench-sse')
+@click.option('--subscribers', default=500, help='Concurrent idle event streams.')
+@click.option('--seconds', default=10.0, help='How long each idle phase is measured.')
+@click.option('--events', 'event_count', default=100, help='Changes published in the fan-out phase.')
+def bench_sse(subscribers, seconds, event_count):
+    """Benchmark /api/events subscribers."""
+    import selectors
+    import socket
+    import time
+    from benchmarks import local_server
+    from events import publish, subscriber_count
+    from models import User
+
+    # /api/events needs a logged-in user and caps the streams per process
+    user = User.query.order_by(User.id).first()
+    if user is None:
+        raise click.ClickException('The event stream needs a user to log in as; seed the database first.')
+    cookie = app.session_interface.get_signing_serializer(app).dumps({'user_id': user.id})
+    request_head = (f'GET /api/events HTTP/1.0\r\nHost: localhost\r\n'
+                    f'Cookie: {app.config["SESSION_COOKIE_NAME"]}={cookie}\r\n\r\n').encode()
+    app.config['SSE_MAX_SUBSCRIBERS'] = max(app.config['SSE_MAX_SUBSCRIBERS'], subscribers)
+
+    server, port = local_server()
+
+    def idle_cpu():
+        wall, cpu = time.perf_counter(), time.process_time()
+        time.sleep(seconds)
+        return (time.process_time() - cpu) / (time.perf_counter() - wall) * 100
+
+    baseline = idle_cpu()
+
+    selector = selectors.DefaultSelector()
+    streams = []
+    for _ in range(subscribers):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(request_head)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+        streams.append(sock)
+
+    # Read every stream until `marker` has arrived `count` times on each
+    def read_until(marker, count, timeout=60):
+        seen = {sock: 0 for sock in streams}
+        tails = {sock: b'' for sock in streams}
+        waiting = set(streams)
+        deadline = time.perf_counter() + timeout
+        while waiting:
+            if time.perf_counter() > deadline:
+                raise click.ClickException('Timed out waiting for the event streams.')
+            for key, _ in selector.select(timeout=1):
+                sock = key.fileobj
+                data = tails[sock] + sock.recv(65536)
+                seen[sock] += data.count(marker)
+                tails[sock] = data[-(len(marker) - 1):]
+                if seen[sock] >= count:
+                    waiting.discard(sock)
+
+    # A stream has subscribed once its retry: line arrives
+    read_until(b'retry:', 1)
+    connected = subscriber_count()
+    with_subscribers = idle_cpu()
+
+    started = time.perf_counter()
+    for i in range(event_count):
+        publish(0, i, 'A')
+    read_until(b'event: spot', event_count)
+    fan_out = time.perf_counter() - started
+
+    for sock in streams:
+        selector.unregister(sock)
+        sock.close()
+    server.shutdown()
+
+    click.echo(f'idle CPU, no subscribers:        {baseline:5.2f}% of one core')
+    click.echo(f'idle CPU, {connected:4} subscribers:      {with_subscribers:5.2f}% of one core '
+               f'(heartbeat every {app.config["SSE_HEARTBEAT"]}s)')
+    click.echo(f'{event_count} events to {connected} subscribers: {fan_out * 1000:.0f} ms '
+               f'({fan_out / event_count * 1000:.2f} ms per event, all subscribers)')
+
+
+# flask vendor-assets: download the pinned third-party CSS/JS/fonts into
+# static/vendor (see assets.VENDOR), so pages are served without CDNs. A build
+# step: pages fail to render until it has run. With --check, only fail if any
+# file is missing.
+@app.cli.command('vendor-assets')
+@click.option('--force', is_flag=True, help='Download files that are already there again.')
+@click.option('--check', is_flag=True, help='Download nothing; fail if a file is missing.')
+def vendor_assets(force, check):
+    """Download pinned vendor assets."""
+    from assets import missing_vendor, vendor
+
+    if check:
+        missing = missing_vendor()
+        for filename in missing:
+            click.echo(f'missing: static/{filename}')
+        if missing:
+            raise click.ClickException(f'{len(missing)} vendored file(s) missing; run `flask vendor-assets`')
+        click.echo('All vendored files are present.')
+        return
+
+    downloaded = 0
+    try:
+        for filename, size in vendor(force=force):
+            click.echo(f'{filename}: {size / 1024:.1f} KiB')
+            downloaded += 1
+    except OSError as exc:
+        raise click.ClickException(f'Download failed after {downloaded} file(s): {exc}')
+    click.echo(f'{downloaded} file(s) downloaded.')
+
+
+# flask compress-assets: write gzip (and, with the brotli package, brotli)
+# variants of the static text assets; run after changing or vendoring them
+@app.cli.command('compress-assets')
+@click.option('--force', is_flag=True, help='Recompress files whose variants are up to date.')
+def compress_assets(force):
+    """Precompress the static text assets."""
+    from assets import brotli, compress
+
+    if brotli is None:
+        click.echo('brotli is not installed; writing gzip variants only.')
+    written = 0
+    for filename, size, sizes in compress(force=force):
+        variants = ', '.join(f'{suffix} {encoded / 1024:.1f} KiB' for suffix, encoded in sizes.items())
+        click.echo(f'{filename}: {size / 1024:.1f} KiB -> {variants}')
+        written += 1
+    click.echo(f'{written} file(s) compressed.')
@@ -1,9 +1,73 @@
 from dotenv import load_dotenv
 import os
 from app import app
+from engine_profile import engine_options
 
 load_dotenv()
 
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
\ No newline at end of file
+app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
+
+# Engine profile (engine_profile.py): development or production
+app.config['DB_PROFILE'] = os.getenv('DB_PROFILE', 'development')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config['DB_PROFILE'])
+
+# In-memory free-spot index (spot_index.py); set to False to always query the database
+app.config['SPOT_INDEX_ENABLED'] = os.getenv('SPOT_INDEX_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+
+# Seconds a cached per-user stats record (stats.user_stats) may be served
+app.config['USER_STATS_TTL'] = int(os.getenv('USER_STATS_TTL', '300'))
+
+# Seconds the auth decorators may trust a cached (exists, is_admin); 0 disables
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.getenv('PRINCIPAL_CACHE_TTL', '0'))
+
+# Keyset pagination (pagination.py): default and maximum rows per page, and
+# where the optional result count stops counting
+app.config['PAGE_SIZE'] = int(os.getenv('PAGE_SIZE', '50'))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv('MAX_PAGE_SIZE', '500'))
+app.config['PAGE_COUNT_CAP'] = int(os.getenv('PAGE_COUNT_CAP', '10000'))
+
+# Trigram search index for reservation/user search (search_index.py); False forces ILIKE
+app.config['SEARCH_INDEX_ENABLED'] = os.getenv('SEARCH_INDEX_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+
+# Reservation expiry (expiry.py): how long past its end a booking may stay
+# Active, how overstay hours are priced, and how a sweep is batched and bounded
+app.config['EXPIRY_GRACE_MINUTES'] = int(os.getenv('EXPIRY_GRACE_MINUTES', '15'))
+app.config['OVERSTAY_MULTIPLIER'] = float(os.getenv('OVERSTAY_MULTIPLIER', '1.5'))
+app.config['EXPIRY_BATCH_SIZE'] = int(os.getenv('EXPIRY_BATCH_SIZE', '500'))
+app.config['EXPIRY_SWEEP_BUDGET_MS'] = int(os.getenv('EXPIRY_SWEEP_BUDGET_MS', '5000'))
+app.config['EXPIRY_INTERVAL'] = int(os.getenv('EXPIRY_INTERVAL', '60'))
+
+# Seconds clients may reuse an availability response before revalidating its ETag
+app.config['AVAILABILITY_MAX_AGE'] = int(os.getenv('AVAILABILITY_MAX_AGE', '5'))
+
+# Live occupancy stream (/api/events, events.py): seconds between keepalives,
+# and how many undelivered events a client may fall behind before it resyncs
+app.config['SSE_HEARTBEAT'] = int(os.getenv('SSE_HEARTBEAT', '15'))
+app.config['SSE_QUEUE_SIZE'] = int(os.getenv('SSE_QUEUE_SIZE', '100'))
+# Event streams a process serves at once (each holds a thread); more get a 503
+app.config['SSE_MAX_SUBSCRIBERS'] = int(os.getenv('SSE_MAX_SUBSCRIBERS', '200'))
+
+# Per-request SQL profiling (sql_profile.py): off unless enabled; how many
+# recent requests /admin/perf picks the worst from, and how often one statement
+# may repeat within a request before it is flagged as an N+1 suspect
+app.config['SQL_PROFILE_ENABLED'] = os.getenv('SQL_PROFILE_ENABLED', 'False').lower() in ('1', 'true', 'yes')
+app.config['SQL_PROFILE_HISTORY'] = int(os.getenv('SQL_PROFILE_HISTORY', '500'))
+app.config['SQL_PROFILE_REPEAT'] = int(os.getenv('SQL_PROFILE_REPEAT', '3'))
+
+# Prometheus metrics (/metrics, metrics.py): a directory shared by the worker
+# processes so any of them can report the totals of all (empty: this process
+# only), and how often each process writes its totals there
+app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', '')
+app.config['METRICS_FLUSH_INTERVAL'] = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+
+# Seconds browsers may cache a static file requested by its fingerprinted URL
+# (assets.py); such URLs change whenever the file does
+app.config['ASSET_MAX_AGE'] = int(os.getenv('ASSET_MAX_AGE', '31536000'))
+
+# Rendered template fragments ({% cache %}, fragment_cache.py): memory budget
+# per process in bytes (0 disables), and seconds an entry may be served before
+# it is rendered again even if its data version has not changed
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+app.config['FRAGMENT_CACHE_TTL'] = int(os.getenv('FRAGMENT_CACHE_TTL', '300'))
@@ -1,8 +1,12 @@
 from .auth import auth
 from .admin import admin
 from .user import user
+from .api import api
+from .monitoring import monitoring
 
 def register_blueprints(app):
     app.register_blueprint(auth, url_prefix='/auth')
     app.register_blueprint(admin)
-    app.register_blueprint(user)
\ No newline at end of file
+    app.register_blueprint(user)
+    app.register_blueprint(api, url_prefix='/api')
+    app.register_blueprint(monitoring)
\ No newline at end of file
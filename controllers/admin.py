@@ -1,14 +1,28 @@
-from flask import Blueprint, render_template, request, url_for, redirect, flash, session, abort
+from flask import Blueprint, render_template, request, url_for, redirect, flash, session, abort, Response, stream_with_context
 from app import app
 from models import db, User, Vehicle, Address, ParkingLot, ParkingSpot, Reservation
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from decorators import admin_required
+from occupancy import adjust_lot_counts, touch_lot
+from allocation import close_reservation, free_spot
+from billing import reservation_cost
+from provisioning import check_layout, provision_spots, remove_lot, remove_user, shrink_lot
+from stats import dashboard_snapshot, invalidate_user_stats
+from pagination import keyset_paginate
+from search_index import reservation_search, user_search
+from rollups import bookings_by_lot, hours_between, record_release, registrations_by_day, revenue_by_day
 from datetime import datetime, timedelta
 from sqlalchemy import func, extract
+from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.expression import case
 import csv
+import io
+import json
 from uuid import uuid4
+import sql_profile
+from metrics import inc
+from fragment_cache import Deferred, stats as fragment_cache_stats
 
 admin = Blueprint('admin', __name__)
 
@@ -20,7 +34,8 @@ admin = Blueprint('admin', __name__)
 @admin.route('/admin/lots')
 @admin_required
 def view_lots():
-    lots = ParkingLot.query.all()
+    # Loaded only when the cached page body is rendered again
+    lots = Deferred(ParkingLot.query.options(joinedload(ParkingLot.address)).all)
     return render_template('admin/view_lots.html', lots=lots)
 
 
@@ -39,24 +54,26 @@ def add_lot():
         state = request.form.get('state')
         pincode = request.form.get('pincode')
         landmark = request.form.get('landmark')
-        
+        rows_per_level = request.form.get('rows_per_level', type=int)
+        bays_per_row = request.form.get('bays_per_row', type=int)
+
+        try:
+            check_layout(max_spots, rows_per_level, bays_per_row)
+        except ValueError as exc:
+            flash(str(exc), 'danger')
+            return redirect(url_for('admin.add_lot'))
+
+        # Address, lot and all of its spots go in as one transaction
         new_address = Address(address=address, city=city, state=state, pincode=pincode, landmark=landmark)
         db.session.add(new_address)
-        db.session.commit()
+        db.session.flush()
 
-        new_lot = ParkingLot(name=name, price_per_hour=price_per_hour, max_spots=max_spots, address_id=new_address.id)
+        new_lot = ParkingLot(name=name, price_per_hour=price_per_hour, max_spots=max_spots, address_id=new_address.id,
+                             rows_per_level=rows_per_level, bays_per_row=bays_per_row)
         db.session.add(new_lot)
-        db.session.commit()
-
+        db.session.flush()
 
-        for i in range(1, max_spots + 1):
-            spot = ParkingSpot(
-                spot_number=str(i),
-                lot_id=new_lot.id,
-                status='A',
-                is_active=True
-            )
-            db.session.add(spot)
+        provision_spots(new_lot, max_spots)
         db.session.commit()
 
 
@@ -81,6 +98,11 @@ def edit_lot(lot_id):
         lot.name = request.form.get('name')
         lot.price_per_hour = float(request.form.get('price_per_hour'))
         new_max_spots = int(request.form.get('max_spots'))
+        try:
+            check_layout(new_max_spots, lot.rows_per_level, lot.bays_per_row)
+        except ValueError as exc:
+            flash(str(exc), 'danger')
+            return redirect(url_for('admin.edit_lot', lot_id=lot.id))
 
         lot.address.address = request.form.get('address')
         lot.address.city = request.form.get('city')
@@ -90,27 +112,22 @@ def edit_lot(lot_id):
 
         old_max_spots = lot.max_spots
         lot.max_spots = new_max_spots
+        touch_lot(lot.id)
 
-        db.session.commit()
-
-        current_spots = ParkingSpot.query.filter_by(lot_id=lot.id).order_by(ParkingSpot.id).all()
-        current_count = len(current_spots)
+        current_count = ParkingSpot.query.filter_by(lot_id=lot.id).count()
 
         if new_max_spots > current_count:
-            for i in range(current_count + 1, new_max_spots + 1):
-                spot = ParkingSpot(
-                    spot_number=str(i),
-                    lot_id=lot.id,
-                    status='A',
-                    is_active=True
-                )
-                db.session.add(spot)
+            provision_spots(lot, new_max_spots - current_count)
             db.session.commit()
         elif new_max_spots < current_count:
-            available_spots = [s for s in current_spots if s.status == 'A']
-            to_remove = current_count - new_max_spots
-            for spot in available_spots[:to_remove]:
-                db.session.delete(spot)
+            removed = shrink_lot(lot, current_count - new_max_spots)
+            if removed < current_count - new_max_spots:
+                # The rest are occupied or have reservation history
+                lot.max_spots = current_count - removed
+                flash(f'Only {removed} spot(s) could be removed; occupied spots and spots with '
+                      f'reservation history are kept.', 'warning')
+            db.session.commit()
+        else:
             db.session.commit()
 
         flash('Parking lot updated.')
@@ -130,7 +147,9 @@ def delete_lot(lot_id):
         flash("Lot not found")
         return redirect(url_for('admin.view_lots'))
     if request.method == 'POST':
-        db.session.delete(lot)
+        if not remove_lot(lot.id):
+            flash('Cannot delete a lot with active reservations.', 'warning')
+            return redirect(url_for('admin.view_lots'))
         db.session.commit()
         flash('Parking lot deleted.')
         return redirect(url_for('admin.view_lots'))
@@ -146,17 +165,12 @@ def view_spots():
     lots = ParkingLot.query.all()
     
     for lot in lots:
-        total_spots = ParkingSpot.query.filter_by(lot_id=lot.id).count()
-        available = ParkingSpot.query.filter_by(lot_id=lot.id, status='A').count()
-        occupied = ParkingSpot.query.filter_by(lot_id=lot.id, status='O').count()
-        maintenance = ParkingSpot.query.filter_by(lot_id=lot.id, status='M').count()
-        
         lots_with_stats.append({
             'lot': lot,
-            'total': total_spots,
-            'available': available,
-            'occupied': occupied,
-            'maintenance': maintenance
+            'total': lot.available_count + lot.occupied_count + lot.maintenance_count,
+            'available': lot.available_count,
+            'occupied': lot.occupied_count,
+            'maintenance': lot.maintenance_count
         })
     
     return render_template('admin/view_spots.html', lots_stats=lots_with_stats)
@@ -205,6 +219,7 @@ def add_spot():
 
         new_spot = ParkingSpot(spot_number=spot_number, lot_id=lot_id, status=status, is_active=is_active)
         db.session.add(new_spot)
+        adjust_lot_counts(lot_id, None, status)
         db.session.commit()
 
         # Increment max_spots
@@ -243,10 +258,17 @@ def edit_spot(lot_id, spot_id):
             flash("Spot number already exists in this lot.")
             return redirect(url_for('admin.edit_spot', spot_id=spot_id))
 
+        if spot.lot_id != lot_id:
+            adjust_lot_counts(spot.lot_id, spot.status, None)
+            adjust_lot_counts(lot_id, None, status)
+        else:
+            adjust_lot_counts(lot_id, spot.status, status)
+
         spot.spot_number = spot_number
         spot.lot_id = lot_id
         spot.status = status
         spot.is_active = is_active
+        touch_lot(lot_id)
 
         db.session.commit()
         flash('Spot updated successfully.')
@@ -267,6 +289,7 @@ def admin_delete_spot(lot_id, spot_id):
         flash("Cannot delete a spot with existing reservations.")
         return redirect(url_for('admin.view_spots'))
 
+    adjust_lot_counts(spot.lot_id, spot.status, None)
     db.session.delete(spot)
     db.session.commit()
 
@@ -281,19 +304,14 @@ def admin_delete_spot(lot_id, spot_id):
 
 
 #------------------------------------------- RESERVATION -----------------------------------------------------------
-# ADMIN: VIEW ALL RESERVATIONS WITH FILTERS
-@admin.route('/admin/reservations')
-@admin_required
-def view_reservations():
+# Apply the reservation filters from the query string (status, start_date,
+# end_date, search). Pass user_joined=True if `query` already joins User.
+def filter_reservations(query, args, user_joined=False):
+    status_filter = args.get('status', '')
+    start_date = args.get('start_date', '')
+    end_date = args.get('end_date', '')
+    search_query = args.get('search', '')
 
-    status_filter = request.args.get('status', '')
-    start_date = request.args.get('start_date', '')
-    end_date = request.args.get('end_date', '')
-    search_query = request.args.get('search', '')
-    
-
-    query = Reservation.query
-    
     # Apply status filter
     if status_filter:
         query = query.filter(Reservation.status == status_filter)
@@ -317,26 +335,94 @@ def view_reservations():
     
     # Apply search filter (search in vehicle plate and user email)
     if search_query:
-        query = query.join(User).filter(
-            db.or_(
-                Reservation.vehicle_plate.ilike(f'%{search_query}%'),
-                User.email.ilike(f'%{search_query}%'),
-                User.full_name.ilike(f'%{search_query}%')
-            )
-        )
+        criterion, needs_user_join = reservation_search(search_query)
+        if needs_user_join and not user_joined:
+            query = query.join(User)
+        query = query.filter(criterion)
+    return query
+
+
+# ADMIN: VIEW ALL RESERVATIONS WITH FILTERS
+@admin.route('/admin/reservations')
+@admin_required
+def view_reservations():
+
+    status_filter = request.args.get('status', '')
+    start_date = request.args.get('start_date', '')
+    end_date = request.args.get('end_date', '')
+    search_query = request.args.get('search', '')
     
-    # Execute query with ordering
-    reservations = query.order_by(Reservation.start_time.desc()).all()
+    query = filter_reservations(Reservation.query, request.args)
+    
+    # Load rows the table shows with the page instead of one query per row
+    query = query.options(
+        joinedload(Reservation.user),
+        joinedload(Reservation.spot).joinedload(ParkingSpot.lot)
+    )
+
+    # One keyset page, newest first
+    page = keyset_paginate(query, Reservation.start_time, Reservation.id,
+                           with_total=request.args.get('count') == '1')
     
     # Pass filter values back to template to maintain form state
     return render_template('admin/view_reservations.html', 
-                         reservations=reservations,
+                         reservations=page.items,
+                         page=page,
                          current_status=status_filter,
                          current_start_date=start_date,
                          current_end_date=end_date,
                          current_search=search_query)
 
 
+# ADMIN: EXPORT RESERVATIONS (CSV or NDJSON), SAME FILTERS AS view_reservations
+EXPORT_COLUMNS = ['id', 'user_name', 'user_email', 'vehicle_plate', 'lot', 'spot',
+                  'status', 'start_time', 'end_time', 'final_cost']
+EXPORT_BATCH = 1000
+
+
+@admin.route('/admin/reservations/export')
+@admin_required
+def export_reservations():
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        abort(400)
+
+    query = db.session.query(
+        Reservation.id, User.full_name, User.email, Reservation.vehicle_plate,
+        ParkingLot.name, ParkingSpot.spot_number, Reservation.status,
+        Reservation.start_time, Reservation.end_time, Reservation.final_cost
+    ).join(User, Reservation.user_id == User.id)\
+     .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)\
+     .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+    query = filter_reservations(query, request.args, user_joined=True)
+    # Server-side cursor where the driver supports it, fetched in batches,
+    # so memory stays flat however many rows are exported
+    rows = query.order_by(Reservation.id).yield_per(EXPORT_BATCH)
+
+    def generate():
+        buffer = io.StringIO()
+        if export_format == 'csv':
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+        for count, row in enumerate(rows, 1):
+            values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            if export_format == 'csv':
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, values))))
+                buffer.write('\n')
+            if count % EXPORT_BATCH == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"reservations-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{export_format}"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
 # Reservation History per User
 @admin.route('/admin/user/<int:user_id>/reservations')
 @admin_required
@@ -350,47 +436,7 @@ def user_reservations(user_id):
 @admin.route('/admin')
 @admin_required
 def index():
-    # Stats calculation
-    stats = {
-        'total_users': User.query.count(),
-        'total_lots': ParkingLot.query.count(),
-        'total_spots': ParkingSpot.query.count(),
-        'active_reservations': Reservation.query.filter_by(status='Active').count()
-    }
-    
-    # Calculate spot status
-    spot_status = {
-        'available': ParkingSpot.query.filter_by(status='A').count(),
-        'occupied': ParkingSpot.query.filter_by(status='O').count(),
-        'maintenance': ParkingSpot.query.filter_by(status='M').count()
-    }
-    
-    # Bookings by parking lot
-    lot_bookings = []
-    lot_names = []
-    for lot in ParkingLot.query.all():
-        bookings = Reservation.query.join(ParkingSpot).filter(
-            ParkingSpot.lot_id == lot.id
-        ).count()
-        lot_bookings.append(bookings)
-        lot_names.append(lot.name)
-    
-    # Revenue trends (last 7 days)
-    revenue_data = []
-    revenue_labels = []
-    for i in range(6, -1, -1):
-        date = datetime.now() - timedelta(days=i)
-        day_start = date.replace(hour=0, minute=0, second=0)
-        day_end = date.replace(hour=23, minute=59, second=59)
-        
-        daily_revenue = db.session.query(
-            func.sum(Reservation.final_cost)
-        ).filter(
-            Reservation.end_time.between(day_start, day_end)
-        ).scalar() or 0
-        
-        revenue_data.append(float(daily_revenue))
-        revenue_labels.append(date.strftime('%a'))
+    snapshot = dashboard_snapshot()
     
     # Recent activities (example implementation)
     recent_activities = [
@@ -405,12 +451,12 @@ def index():
     
     return render_template(
         'admin/index.html',
-        stats=stats,
-        spot_status=spot_status,
-        lot_bookings=lot_bookings,
-        lot_names=lot_names,
-        revenue_data=revenue_data,
-        revenue_labels=revenue_labels,
+        stats=snapshot['stats'],
+        spot_status=snapshot['spot_status'],
+        lot_bookings=snapshot['lot_bookings'],
+        lot_names=snapshot['lot_names'],
+        revenue_data=snapshot['revenue_data'],
+        revenue_labels=snapshot['revenue_labels'],
         recent_activities=recent_activities,
         datetime=datetime
     )
@@ -434,15 +480,13 @@ def manage_users():
             flash(f"User role {'promoted to admin' if user.is_admin else 'demoted to user'}", 'success')
             
         elif action == 'delete':
-            if not user.is_admin:
-                # Delete associated data
-                Reservation.query.filter_by(user_id=user_id).delete()
-                Vehicle.query.filter_by(user_id=user_id).delete()
-                db.session.delete(user)
+            if user.is_admin:
+                flash("Cannot delete admin users", 'warning')
+            elif not remove_user(user.id):
+                flash("Cannot delete a user with an active reservation", 'warning')
+            else:
                 db.session.commit()
                 flash("User deleted successfully", 'success')
-            else:
-                flash("Cannot delete admin users", 'warning')
                 
         return redirect(url_for('admin.manage_users'))
     
@@ -454,11 +498,7 @@ def manage_users():
     
     # Apply search filter
     if q:
-        query = query.filter(
-            (User.full_name.ilike(f'%{q}%')) |
-            (User.email.ilike(f'%{q}%')) |
-            (User.phone.ilike(f'%{q}%'))
-        )
+        query = query.filter(user_search(q))
     
     # Apply role filter
     if role_filter != 'all':
@@ -470,26 +510,18 @@ def manage_users():
     # Calculate statistics (without active_users)
     now = datetime.utcnow()
     week_ago = now - timedelta(days=7)
-    month_ago = now - timedelta(days=30)
+
+    start_date = now - timedelta(days=29)
+    registrations = registrations_by_day(start_date.date())
 
     stats = {
         'total_users': User.query.count(),
-        'new_users_week': User.query.filter(User.registered_on >= week_ago).count(),
-        'new_users_month': User.query.filter(User.registered_on >= month_ago).count()
+        'new_users_week': sum(n for day, n in registrations.items() if day >= week_ago.date()),
+        'new_users_month': sum(registrations.values())
     }
 
     # Calculate registration graph data
-    start_date = now - timedelta(days=29)
-    registration_counts = []
-
-    for i in range(30):
-        day = start_date + timedelta(days=i)
-        next_day = day + timedelta(days=1)
-        count = User.query.filter(
-            User.registered_on >= day,
-            User.registered_on < next_day
-        ).count()
-        registration_counts.append(count)
+    registration_counts = [registrations.get((start_date + timedelta(days=i)).date(), 0) for i in range(30)]
 
     reg_graph = {
         'labels': [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(30)],
@@ -640,30 +672,36 @@ def summary():
     released_reservations = Reservation.query.filter_by(status='released').count()
     expired_reservations = Reservation.query.filter(
         Reservation.end_time < now,
-        Reservation.status == 'expired'
+        Reservation.status == 'Expired'
     ).count()
     
     # Average calculations
-    avg_duration = db.session.query(
-        func.avg(Reservation.end_time - Reservation.start_time)
+    # Datetime subtraction is not portable SQL (SQLite subtracts the leading years)
+    avg_hours = db.session.query(
+        func.avg(hours_between(Reservation.start_time, Reservation.end_time))
     ).scalar()
+    avg_duration = timedelta(hours=avg_hours) if avg_hours is not None else None
     
     avg_cost = db.session.query(
         func.avg(Reservation.final_cost)
     ).scalar()
     
-    # Chart 1: Bookings by Parking Lot
-    lot_bookings = db.session.query(
-        ParkingLot.name,
-        func.count(Reservation.id)
-    ).join(ParkingSpot, ParkingSpot.lot_id == ParkingLot.id)\
-     .join(Reservation, Reservation.spot_id == ParkingSpot.id)\
-     .group_by(ParkingLot.name)\
-     .all()
-    
-    lot_names = [result[0] for result in lot_bookings]
-    lot_booking_counts = [result[1] for result in lot_bookings]
-    
+    # Charts 1 and 3 read the daily rollups only when the cached chart fragment
+    # is rendered again (a lot, spot or reservation changed, or a new day)
+    def chart_data():
+        # Chart 1: Bookings by Parking Lot
+        lot_bookings = bookings_by_lot(only_booked=True)
+
+        # Chart 3: Revenue Trends (Last 7 Days)
+        days = [(now - timedelta(days=i)).date() for i in range(6, -1, -1)]
+        revenue = revenue_by_day(days[0], days[-1])
+        return {
+            'lot_names': [result[0] for result in lot_bookings],
+            'lot_bookings': [result[1] for result in lot_bookings],
+            'revenue_labels': [day.strftime('%Y-%m-%d') for day in days],
+            'revenue_data': [revenue.get(day, 0.0) for day in days]
+        }
+
     # Chart 2: Spot Status Overview
     spot_status = {
         'available': available_spots,
@@ -671,26 +709,6 @@ def summary():
         'maintenance': inactive_spots
     }
     
-    # Chart 3: Revenue Trends (Last 7 Days)
-    revenue_by_day = db.session.query(
-        func.date(Reservation.end_time),
-        func.sum(Reservation.final_cost)
-    ).filter(Reservation.end_time >= one_week_ago)\
-     .group_by(func.date(Reservation.end_time))\
-     .order_by(func.date(Reservation.end_time))\
-     .all()
-    
-    # Generate all dates in the last 7 days
-    date_labels = [(now - timedelta(days=i)).strftime('%Y-%m-%d') for i in range(6, -1, -1)]
-    revenue_data = [0.0] * 7
-    
-    # Fill in revenue data where available
-    for result in revenue_by_day:
-        date_str = result[0]  # Already a string in 'YYYY-MM-DD' format
-        if date_str in date_labels:
-            idx = date_labels.index(date_str)
-            revenue_data[idx] = float(result[1]) if result[1] else 0.0
-    
     # Recent activities (dummy data)
     recent_activities = [
         {'title': 'New user registered', 'time': '2 minutes ago', 'icon': 'fas fa-user-plus', 'icon_class': 'info'},
@@ -722,15 +740,21 @@ def summary():
         avg_cost=avg_cost,
         
         # Chart data
-        lot_names=lot_names,
-        lot_bookings=lot_booking_counts,
+        charts=Deferred(chart_data),
+        chart_day=now.date(),
         spot_status=spot_status,
-        revenue_labels=date_labels,
-        revenue_data=revenue_data,
         recent_activities=recent_activities
     )
 
 
+# ADMIN: SLOWEST RECENT REQUESTS BY SQL TIME (SQL_PROFILE_ENABLED), FRAGMENT CACHE USE
+@admin.route('/admin/perf')
+@admin_required
+def perf():
+    return render_template('admin/perf.html', enabled=sql_profile.enabled(), profiles=sql_profile.worst_requests(),
+                           history=app.config['SQL_PROFILE_HISTORY'], repeat=app.config['SQL_PROFILE_REPEAT'],
+                           fragment_cache=fragment_cache_stats())
+
 
 
 
@@ -750,13 +774,27 @@ def spot_details(spot_id):
 def release_spot(spot_id):
     spot = ParkingSpot.query.get_or_404(spot_id)
     if spot.status == 'O':
-        # Find active reservation and mark as completed
+        # Close the active reservation before freeing the spot, in the order
+        # user releases and expiry sweeps lock rows (reservation, spot, lot).
+        # Its user or a sweep may have got there first.
         reservation = Reservation.query.filter_by(spot_id=spot_id, status='Active').first()
         if reservation:
-            reservation.status = 'Completed'
-            reservation.end_time = datetime.now()
-        spot.status = 'A'  # Set to Available
+            end_time = datetime.utcnow()
+            cost = reservation_cost(reservation.start_time, end_time, spot.lot.price_per_hour)
+            if not close_reservation(reservation, 'Completed', end_time, cost):
+                db.session.rollback()
+                flash('Spot is already released.')
+                return redirect(url_for('admin.view_spots'))
+        if not free_spot(spot.id, spot.lot_id):
+            db.session.rollback()
+            flash('Spot is already released.')
+            return redirect(url_for('admin.view_spots'))
+        if reservation:
+            record_release(reservation, spot.lot_id)
         db.session.commit()
+        if reservation:
+            invalidate_user_stats(reservation.user_id)
+            inc('parking_releases_total', 'admin')
         flash('Spot released successfully.')
     return redirect(url_for('admin.view_spots'))
 
@@ -0,0 +1,41 @@
+from flask import Blueprint, Response, abort, request
+from models import db, ParkingLot
+from availability import all_lots, conditional_json, lot_etag, lot_payload, lots_etag, lots_payload
+from decorators import login_required
+from events import BUSY_RETRY_AFTER, stream, subscribe, unsubscribe
+
+api = Blueprint('api', __name__)
+
+
+# AVAILABILITY OF ALL LOTS
+@api.route('/availability')
+def availability():
+    lots = all_lots()
+    etag = lots_etag(lots)
+    return conditional_json(etag, lambda: lots_payload(lots))
+
+
+# AVAILABILITY OF ONE LOT, WITH ITS FREE SPOTS
+@api.route('/availability/<int:lot_id>')
+def lot_availability(lot_id):
+    lot = db.session.get(ParkingLot, lot_id)
+    if not lot:
+        abort(404)
+    return conditional_json(lot_etag(lot), lambda: lot_payload(lot))
+
+
+# LIVE SPOT STATUS CHANGES (SERVER-SENT EVENTS), OPTIONALLY FOR ONE LOT
+@api.route('/events')
+@login_required
+def events():
+    subscriber = subscribe(request.args.get('lot_id', type=int))
+    if subscriber is None:
+        response = Response('Too many live event streams, try again later.\n', 503, mimetype='text/plain')
+        response.headers['Retry-After'] = str(BUSY_RETRY_AFTER)
+        return response
+    response = Response(stream(subscriber, resync='Last-Event-ID' in request.headers), mimetype='text/event-stream')
+    response.call_on_close(lambda: unsubscribe(subscriber))
+    response.cache_control.no_cache = True
+    # Stop proxies such as nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
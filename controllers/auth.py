@@ -3,6 +3,8 @@ from app import app
 from models import db, User
 from werkzeug.security import check_password_hash, generate_password_hash
 from decorators import login_required
+from rollups import record_registration
+from metrics import inc
 
 auth = Blueprint('auth', __name__)
 
@@ -22,16 +24,19 @@ def login_post():
     user = User.query.filter_by(email=email).first()
  
     if not user:
+        inc('auth_logins_total', 'unknown_user')
         flash('Username does not exist')
         return redirect(url_for('auth.login'))
     
     if not check_password_hash(user.password, password):
+        inc('auth_logins_total', 'wrong_password')
         flash('Incorrect password')
         return redirect(url_for('auth.login'))
     
     session['user_id'] = user.id
     session['email'] = user.email
     session['is_admin'] = user.is_admin
+    inc('auth_logins_total', 'success')
     flash('Login Successful')
 
     if user.is_admin:
@@ -70,6 +75,8 @@ def register_post():
     generate_password = generate_password_hash(password)
     new_user = User(full_name=full_name, email=email, password=generate_password, phone=phone)
     db.session.add(new_user)
+    db.session.flush()
+    record_registration(new_user)
     db.session.commit()
 
     flash('Registration successful! Now you can book your slot')
@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from metrics import render
+
+monitoring = Blueprint('monitoring', __name__)
+
+
+# PROMETHEUS METRICS (metrics.py)
+@monitoring.route('/metrics')
+def metrics():
+    return Response(render(), mimetype='text/plain; version=0.0.4')
@@ -4,9 +4,19 @@ from models import db, User, Vehicle, Address, ParkingLot, ParkingSpot, Reservat
 from werkzeug.security import generate_password_hash
 from functools import wraps
 from sqlalchemy import func
-from decorators import login_required
+from sqlalchemy.orm import joinedload
+from decorators import login_required, current_user
+from allocation import claim_spot, close_reservation, free_spot
+from spot_index import list_free_spots
+from search_index import search_lots
+from availability import conditional_json, lot_etag, lot_payload
+from pagination import keyset_paginate
+from rollups import record_booking, record_release
+from stats import invalidate_user_stats, user_stats
+from billing import estimate_cost, reservation_cost
+from metrics import inc
+from fragment_cache import Deferred
 from datetime import datetime, timedelta
-import math
 
 user = Blueprint('user', __name__)
 
@@ -38,7 +48,7 @@ def index():
 @user.route('/profile', methods=['GET', 'POST'])
 @login_required
 def profile():
-    user_obj = User.query.get(session['user_id'])
+    user_obj = current_user()
     
     vehicle = user_obj.vehicles[0] if user_obj.vehicles else None
 
@@ -96,13 +106,14 @@ def profile():
 @user.route('/lots/<int:lot_id>/spots')
 @login_required
 def view_spots(lot_id):
-    spots = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').all()
-    return {
-        "spots": [
-            {"id": spot.id, "spot_number": spot.spot_number}
-            for spot in spots
-        ]
-    }
+    lot = db.session.get(ParkingLot, lot_id)
+    if not lot:
+        return {"spots": []}
+    return conditional_json(
+        lot_etag(lot),
+        lambda: {"spots": lot_payload(lot)["spots"]},
+        public=False
+    )
 
 
 # ADD VEHICLE
@@ -133,10 +144,10 @@ def add_vehicle():
 @login_required
 def book_spot(lot_id):
     lot = ParkingLot.query.get_or_404(lot_id)
-    available_spots = ParkingSpot.query.filter_by(lot_id=lot_id, status='A').all()
+    available_spots = list_free_spots(lot_id, lot.available_count)
     user_id = session['user_id']
 
-    user = User.query.get(user_id)
+    user = current_user()
     vehicle = user.vehicles[0] if user.vehicles else None
     address = user.address if user.address else None
 
@@ -151,24 +162,33 @@ def book_spot(lot_id):
         pincode = request.form.get('pincode')
         landmark = request.form.get('landmark')
 
-        spot = ParkingSpot.query.filter_by(id=spot_id, status='A').first()
-        if not spot:
+        # 'any' lets the allocator pick the first free spot in the lot
+        if spot_id == 'any':
+            claimed_id = claim_spot(lot_id, expected_free=lot.available_count)
+        elif spot_id and spot_id.isdigit():
+            claimed_id = claim_spot(lot_id, int(spot_id))
+        else:
+            claimed_id = None
+        if not claimed_id:
+            db.session.rollback()
+            inc('parking_booking_failures_total', 'invalid_spot')
             flash("Invalid spot selection", "danger")
             return redirect(url_for('user.book_spot', lot_id=lot_id))
         
+        start_time = datetime.utcnow()
         new_reservation = Reservation(
             user_id=user_id, 
-            spot_id=spot.id,
+            spot_id=claimed_id,
             vehicle_plate=plate_number,
-            start_time=datetime.utcnow(),
-            end_time=datetime.utcnow() + timedelta(hours=1),
+            start_time=start_time,
+            end_time=start_time + timedelta(hours=1),
             status='Active'
         )
         
-        spot.status = 'O'  
-        
         db.session.add(new_reservation)
+        record_booking(new_reservation, lot_id)
         db.session.commit()
+        inc('parking_bookings_total')
         
         flash('Booking successful!', 'success')
         return redirect(url_for('user.user_info'))
@@ -188,23 +208,27 @@ def release_reservation(res_id):
     
     if request.method == 'POST':
         end_time = datetime.utcnow()
-        duration = math.ceil((end_time - reservation.start_time).total_seconds() / 3600)
-        rate = reservation.spot.lot.price_per_hour
-        amount = round(duration * rate, 2)
-
-        reservation.status = 'Released'
-        reservation.end_time = end_time
-        reservation.spot.status = 'A'
-        reservation.final_cost = amount
+        lot_id = reservation.spot.lot_id
+        amount = reservation_cost(reservation.start_time, end_time, reservation.spot.lot.price_per_hour)
+
+        # Only the request whose UPDATE still finds it Active releases it; a
+        # double submit or the expiry sweep may have got there first
+        if not close_reservation(reservation, 'Released', end_time, amount):
+            db.session.rollback()
+            flash('Reservation is already released')
+            return redirect(url_for('user.user_info'))
+
+        free_spot(reservation.spot_id, lot_id)
+        record_release(reservation, lot_id)
         db.session.commit()
+        invalidate_user_stats(reservation.user_id)
+        inc('parking_releases_total', 'user')
         flash('Reservation released successfully')
         return redirect(url_for('user.user_info'))
     
 
     current_time = datetime.utcnow()
-    duration = math.ceil((current_time - reservation.start_time).total_seconds() / 3600)
-    rate = reservation.spot.lot.price_per_hour
-    estimated_cost = round(duration * rate, 2)
+    estimated_cost = estimate_cost(reservation, current_time)
     
     return render_template('user/release.html', reservation=reservation, current_time=current_time,estimated_cost=estimated_cost)
 
@@ -216,11 +240,8 @@ from collections import Counter
 @login_required
 def summary():
     user_id = session['user_id']
-    current_user = User.query.get(user_id)
-    total_bookings = Reservation.query.filter_by(user_id=user_id).count()
-    total_spent = db.session.query(
-        func.coalesce(func.sum(Reservation.final_cost), 0.0)
-    ).filter_by(user_id=user_id).scalar()
+    user = current_user()
+    stats = user_stats(user_id)
     active_session = Reservation.query.filter_by(
         user_id=user_id, status='Active'
     ).first()
@@ -229,44 +250,17 @@ def summary():
     if active_session:
         current_duration = round((datetime.utcnow() - active_session.start_time).total_seconds() / 3600, 1)
         if active_session.spot and active_session.spot.lot:
-            current_cost = round(current_duration * active_session.spot.lot.price_per_hour, 2)
-
-    completed = Reservation.query.filter_by(
-        user_id=user_id, status='Released'
-    ).all()
-    total_hours = 0.0
-    for res in completed:
-        if res.end_time:
-            hours = (res.end_time - res.start_time).total_seconds() / 3600
-            total_hours += hours
-    avg_duration = round(total_hours / len(completed), 1) if completed else 0.0
-
-    # Active/completed bookings
-    active_sessions_count = Reservation.query.filter_by(
-        user_id=user_id, status='Active'
-    ).count()
-    completed_bookings = Reservation.query.filter_by(
-        user_id=user_id, status='Released'
-    ).count()
+            current_cost = estimate_cost(active_session)
 
     # Monthly statistics (for last 6 months)
     now = datetime.utcnow()
     monthly_costs = {}
     for i in range(5, -1, -1):
         month = (now.replace(day=1) - timedelta(days=30*i)).replace(day=1)
-        next_month = (month + timedelta(days=32)).replace(day=1)
-        label = month.strftime('%b %Y')
-        cost = db.session.query(
-            func.coalesce(func.sum(Reservation.final_cost), 0.0)
-        ).filter(
-            Reservation.user_id == user_id,
-            Reservation.start_time >= month,
-            Reservation.start_time < next_month
-        ).scalar()
-        monthly_costs[label] = float(cost or 0)
+        monthly_costs[month.strftime('%b %Y')] = stats['months'].get((month.year, month.month), {}).get('cost', 0.0)
 
     # Vehicle type counts
-    vehicle_types = [v.vehicle_type for v in current_user.vehicles]
+    vehicle_types = [v.vehicle_type for v in user.vehicles]
     vehicle_type_counts = dict(Counter(vehicle_types))
 
     # Monthly bookings for doughnut chart
@@ -276,31 +270,23 @@ def summary():
     previous_month_end = first_of_last_month - timedelta(seconds=1)
     first_of_previous_month = previous_month_end.replace(day=1)
 
-    current_month_bookings = Reservation.query.filter(
-        Reservation.user_id == user_id,
-        Reservation.start_time >= first_of_this_month
-    ).count()
-    last_month_bookings = Reservation.query.filter(
-        Reservation.user_id == user_id,
-        Reservation.start_time >= first_of_last_month,
-        Reservation.start_time < first_of_this_month
-    ).count()
-    previous_bookings = Reservation.query.filter(
-        Reservation.user_id == user_id,
-        Reservation.start_time >= first_of_previous_month,
-        Reservation.start_time < first_of_last_month
-    ).count()
+    def month_bookings(first_day):
+        return stats['months'].get((first_day.year, first_day.month), {}).get('bookings', 0)
+
+    current_month_bookings = month_bookings(first_of_this_month)
+    last_month_bookings = month_bookings(first_of_last_month)
+    previous_bookings = month_bookings(first_of_previous_month)
 
     return render_template('user/summary.html',
-        user=current_user,
-        total_bookings=total_bookings,
-        total_spent=total_spent,
+        user=user,
+        total_bookings=stats['total_bookings'],
+        total_spent=stats['total_spent'],
         current_duration=current_duration,
         current_cost=current_cost,
-        total_hours=round(total_hours, 1),
-        avg_duration=avg_duration,
-        active_sessions_count=active_sessions_count,
-        completed_bookings=completed_bookings,
+        total_hours=round(stats['total_hours'], 1),
+        avg_duration=round(stats['avg_duration'], 1),
+        active_sessions_count=stats['active'],
+        completed_bookings=stats['completed'],
         current_month_bookings=current_month_bookings,
         last_month_bookings=last_month_bookings,
         previous_bookings=previous_bookings,
@@ -315,7 +301,7 @@ def summary():
 @user.route('/user_info')
 @login_required
 def user_info():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     lots = ParkingLot.query.all()
     current_date = datetime.utcnow()
 
@@ -329,21 +315,12 @@ def user_info():
     ).order_by(Reservation.start_time.desc()).limit(5).all()
 
     # --- Add these stats calculations ---
-    total_bookings = Reservation.query.filter_by(user_id=user.id).count()
-    completed = Reservation.query.filter_by(user_id=user.id, status='Released').count()
-    active_now = Reservation.query.filter_by(user_id=user.id, status='Active').count()
-    # Calculate total hours parked
-    total_hours = 0
-    completed_reservations = Reservation.query.filter_by(user_id=user.id, status='Released').all()
-    for res in completed_reservations:
-        if res.end_time:
-            total_hours += (res.end_time - res.start_time).total_seconds() / 3600
-
+    user_totals = user_stats(user.id)
     stats = {
-        'total_bookings': total_bookings,
-        'completed': completed,
-        'active_now': active_now,
-        'total_hours': round(total_hours, 1)
+        'total_bookings': user_totals['total_bookings'],
+        'completed': user_totals['completed'],
+        'active_now': user_totals['active'],
+        'total_hours': round(user_totals['total_hours'], 1)
     }
     # --------------------------------------
 
@@ -363,18 +340,13 @@ def user_info():
 @user.route('/new_booking', methods=['GET', 'POST'])
 @login_required
 def new_booking():
-    user = User.query.get(session['user_id'])
+    user = current_user()
     current_date = datetime.utcnow()
-    lots = []
 
+    # Lots with their address and free-spot counter in one query, best first;
+    # run only when the cached lot list is rendered again
     search_query = request.args.get('q')
-    if search_query:
-        lots = ParkingLot.query.join(Address).filter(
-            (Address.address.ilike(f'%{search_query}%')) |
-            (Address.pincode.ilike(f'%{search_query}%'))
-        ).all()
-    else:
-        lots = ParkingLot.query.all()
+    lots = Deferred(lambda: search_lots(search_query))
     return render_template('user/new_booking.html', user=user, lots=lots, current_date=current_date, search_query=search_query)
 
 
@@ -383,8 +355,11 @@ def new_booking():
 @login_required
 def history():
     user_id = session['user_id']
-    history = Reservation.query.filter_by(user_id=user_id).order_by(Reservation.start_time.desc()).all()
-    return render_template('user/history.html', history=history)
+    query = Reservation.query.filter_by(user_id=user_id).options(
+        joinedload(Reservation.spot).joinedload(ParkingSpot.lot)
+    )
+    page = keyset_paginate(query, Reservation.start_time, Reservation.id)
+    return render_template('user/history.html', history=page.items, page=page, current_date=datetime.utcnow())
 
 
 
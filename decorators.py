@@ -1,8 +1,73 @@
-from flask import redirect, session, url_for, flash, abort
+import threading
+import time
+from flask import redirect, session, url_for, flash, abort, g
 from functools import wraps
-from models import User
+from sqlalchemy import event
+from app import app
+from models import db, User
 
 
+# ---------------------------------------------------- PRINCIPAL ----------------------------------------------------
+
+# user_id -> (loaded at, is_admin) for users known to exist. Only used when
+# PRINCIPAL_CACHE_TTL > 0; entries are dropped when the user is changed or
+# deleted (see _track_user_changes) and expire after the TTL so other worker
+# processes pick up role changes too.
+_principals = {}
+_principals_lock = threading.Lock()
+
+
+# The logged-in User, loaded at most once per request
+def current_user():
+    if 'user' not in g:
+        g.user = db.session.get(User, session['user_id']) if 'user_id' in session else None
+        if g.user:
+            _remember_principal(g.user)
+    return g.user
+
+
+# Returns (exists, is_admin) for the logged-in user, from the cache when fresh
+def _principal():
+    ttl = app.config['PRINCIPAL_CACHE_TTL']
+    entry = _principals.get(session['user_id']) if ttl > 0 else None
+    if entry and time.monotonic() - entry[0] < ttl:
+        return True, entry[1]
+    user = current_user()
+    return user is not None, bool(user and user.is_admin)
+
+
+def _remember_principal(user):
+    if app.config['PRINCIPAL_CACHE_TTL'] > 0:
+        with _principals_lock:
+            _principals[user.id] = (time.monotonic(), user.is_admin)
+
+
+def invalidate_principal(*user_ids):
+    with _principals_lock:
+        for user_id in user_ids:
+            _principals.pop(user_id, None)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_user_changes(session, flush_context):
+    changed = session.info.setdefault('principals_changed', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _drop_changed_principals(session):
+    invalidate_principal(*session.info.pop('principals_changed', ()))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_principals(session):
+    session.info.pop('principals_changed', None)
+
+
+# ---------------------------------------------------- DECORATORS ----------------------------------------------------
+
 # Helper: Admin-only access decorator
 def admin_required(f):
     @wraps(f)
@@ -10,9 +75,9 @@ def admin_required(f):
         if 'user_id' not in session:
             flash('Login required')
             return redirect(url_for('auth.login'))
-        
-        user = User.query.get(session['user_id'])
-        if not user or not user.is_admin:
+
+        exists, is_admin = _principal()
+        if not exists or not is_admin:
             return redirect(url_for('auth.login'))
         return f(*args, **kwargs)
     return decorated_function
@@ -25,12 +90,9 @@ def login_required(f):
         if 'user_id' not in session:
             flash('Login required')
             return redirect(url_for('auth.login'))
-        
-        user = User.query.get(session['user_id'])
-        if not user:
+
+        exists, _ = _principal()
+        if not exists:
             abort(403)
         return f(*args, **kwargs)
     return decorated_function
-
-
-
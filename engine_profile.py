@@ -0,0 +1,70 @@
+import os
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+# Database engine profiles, picked with DB_PROFILE.
+#
+#   development  SQLAlchemy defaults (rollback journal on SQLite, default pool)
+#                apart from foreign key enforcement, which SQLite always gets
+#   production   SQLite: WAL journal, synchronous=NORMAL, a busy timeout and a
+#                larger page cache/mmap, so readers never block the writer and
+#                writers queue instead of failing with "database is locked".
+#                Server databases: a sized, pre-pinged, recycled connection pool.
+#
+# The numbers can be overridden from the environment (see .env.sample).
+
+PROFILES = ('development', 'production')
+
+
+def _int_env(name, default):
+    return int(os.getenv(name, default))
+
+
+def sqlite_pragmas(profile):
+    # SQLite only honours foreign keys (and their ON DELETE rules) when asked
+    pragmas = {'foreign_keys': 'ON'}
+    if profile != 'production':
+        return pragmas
+    return {
+        **pragmas,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': _int_env('SQLITE_BUSY_TIMEOUT_MS', '5000'),
+        # negative cache_size is in KiB
+        'cache_size': -_int_env('SQLITE_CACHE_KB', '65536'),
+        'mmap_size': _int_env('SQLITE_MMAP_BYTES', str(256 * 1024 * 1024)),
+        'temp_store': 'MEMORY',
+    }
+
+
+# SQLALCHEMY_ENGINE_OPTIONS for `uri` under `profile`
+def engine_options(uri, profile):
+    if profile not in PROFILES:
+        raise ValueError(f'DB_PROFILE must be one of {", ".join(PROFILES)}, not {profile!r}')
+    if profile != 'production' or not uri:
+        return {}
+    if make_url(uri).get_backend_name() == 'sqlite':
+        # pysqlite's own busy wait, in seconds; kept in step with busy_timeout
+        return {'connect_args': {'timeout': _int_env('SQLITE_BUSY_TIMEOUT_MS', '5000') / 1000}}
+    return {
+        'pool_size': _int_env('DB_POOL_SIZE', '10'),
+        'max_overflow': _int_env('DB_MAX_OVERFLOW', '20'),
+        'pool_timeout': _int_env('DB_POOL_TIMEOUT', '30'),
+        'pool_recycle': _int_env('DB_POOL_RECYCLE', '1800'),
+        'pool_pre_ping': True,
+    }
+
+
+# Run the profile's PRAGMAs on every new SQLite connection of `engine`
+def configure_engine(engine, profile):
+    pragmas = sqlite_pragmas(profile) if engine.dialect.name == 'sqlite' else {}
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
@@ -0,0 +1,120 @@
+import itertools
+import json
+import queue
+import threading
+from app import app
+
+
+# In-process pub/sub of spot status changes, streamed to browsers as
+# Server-Sent Events by /api/events.
+#
+# spot_index publishes every committed change (booking, release, expiry, admin
+# edits all go through record_change). Each subscriber has its own bounded
+# queue: publishing never blocks, and a client too slow to keep up loses only
+# its own events and is then told to resync from /api/availability. An idle
+# subscriber is a thread blocked on its queue, woken once per SSE_HEARTBEAT.
+#
+# Subscribers are per process: with several worker processes a stream only
+# sees the changes committed by its own worker. Each open stream holds a server
+# thread, so a process takes at most SSE_MAX_SUBSCRIBERS of them at a time.
+
+RETRY_MS = 3000
+# Seconds a client turned away for too many streams is asked to wait
+BUSY_RETRY_AFTER = 30
+
+
+class Subscriber:
+    def __init__(self, lot_id, maxsize):
+        self.lot_id = lot_id
+        self.queue = queue.Queue(maxsize)
+        self.overflowed = False
+
+
+_subscribers = set()
+_lock = threading.Lock()
+_event_ids = itertools.count(1)
+
+
+# Subscribe to changes of one lot, or of every lot when lot_id is None.
+# Returns None when SSE_MAX_SUBSCRIBERS streams are already open.
+def subscribe(lot_id=None):
+    subscriber = Subscriber(lot_id, app.config['SSE_QUEUE_SIZE'])
+    with _lock:
+        if len(_subscribers) >= app.config['SSE_MAX_SUBSCRIBERS']:
+            return None
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber):
+    with _lock:
+        _subscribers.discard(subscriber)
+
+
+def subscriber_count():
+    return len(_subscribers)
+
+
+# spot_id None means the lot changed as a whole (spots added or removed, bulk
+# expiry): clients refetch it. status None means the spot was deleted.
+def publish(lot_id, spot_id=None, status=None):
+    event = (next(_event_ids), lot_id, spot_id, status)
+    with _lock:
+        for subscriber in _subscribers:
+            if subscriber.lot_id is not None and subscriber.lot_id != lot_id:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except queue.Full:
+                subscriber.overflowed = True
+
+
+# Publish the (lot_id, spot_id, status) changes of one transaction, once per
+# spot with its final status; a lot-wide change covers its spot changes.
+def publish_changes(changes):
+    if not _subscribers:
+        return
+    whole_lots = {lot_id for lot_id, spot_id, _ in changes if spot_id is None}
+    spots = {}
+    for lot_id, spot_id, status in changes:
+        if lot_id not in whole_lots:
+            spots[(lot_id, spot_id)] = status
+    for lot_id in sorted(whole_lots):
+        publish(lot_id)
+    for (lot_id, spot_id), status in spots.items():
+        publish(lot_id, spot_id, status)
+
+
+def _format(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+# The SSE body for one subscriber. Unsubscribes when the client goes away (the
+# server closes the generator); a response that never started streaming has to
+# unsubscribe when it is closed. A reconnecting client (resync=True) may have
+# missed events, so it is told to resync first.
+def stream(subscriber, heartbeat=None, resync=False):
+    heartbeat = heartbeat or app.config['SSE_HEARTBEAT']
+    lot_id = subscriber.lot_id
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        if resync:
+            yield _format(0, 'resync', {'lot_id': lot_id})
+        while True:
+            try:
+                event_id, event_lot_id, spot_id, status = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            if subscriber.overflowed:
+                # Events were dropped; everything queued is stale too
+                while not subscriber.queue.empty():
+                    event_id = subscriber.queue.get_nowait()[0]
+                subscriber.overflowed = False
+                yield _format(event_id, 'resync', {'lot_id': lot_id})
+            elif spot_id is None:
+                yield _format(event_id, 'lot', {'lot_id': event_lot_id})
+            else:
+                yield _format(event_id, 'spot', {'lot_id': event_lot_id, 'spot_id': spot_id, 'status': status})
+    finally:
+        unsubscribe(subscriber)
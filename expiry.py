@@ -0,0 +1,111 @@
+import time
+from collections import Counter, namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from app import app
+from billing import expiry_cost
+from models import db, ParkingLot, ParkingSpot, Reservation
+from occupancy import adjust_lot_counts
+from rollups import record_releases
+from stats import invalidate_user_stats
+
+
+# Expiry of overdue reservations.
+#
+# A reservation is overdue when it is still Active EXPIRY_GRACE_MINUTES after
+# its booked end_time. A sweep walks overdue reservations oldest first through
+# the (status, end_time) index, EXPIRY_BATCH_SIZE at a time. Each batch marks
+# them Expired, bills them (billing.expiry_cost), frees their spots and moves
+# the lot counters and rollups in a fixed number of statements, then commits.
+# Every UPDATE is conditional on the current status, as are user and admin
+# releases (allocation.close_reservation): whichever ends a reservation first
+# frees its spot and bills it, the other finds it no longer Active. So sweeps
+# are safe to run next to releases and next to each other.
+
+UNSYNCHRONIZED = {'synchronize_session': False}
+
+_Expired = namedtuple('_Expired', 'user_id start_time end_time final_cost')
+
+
+# Apply the conditional UPDATE `stmt` to the rows in `ids`; returns the ids it changed
+def _update_changed(stmt, id_column, ids):
+    if db.engine.dialect.update_returning:
+        return set(db.session.execute(
+            stmt.where(id_column.in_(ids)).returning(id_column), execution_options=UNSYNCHRONIZED
+        ).scalars())
+    # Without RETURNING, one statement per row tells us which rows matched
+    return {row_id for row_id in ids
+            if db.session.execute(stmt.where(id_column == row_id), execution_options=UNSYNCHRONIZED).rowcount}
+
+
+# Expire up to `batch_size` reservations that were overdue at `cutoff`.
+# Returns (candidates found, reservations expired, user ids touched).
+def _expire_batch(now, cutoff, batch_size):
+    candidates = db.session.execute(
+        select(Reservation.id, Reservation.user_id, Reservation.spot_id, Reservation.start_time,
+               Reservation.end_time, ParkingSpot.lot_id, ParkingLot.price_per_hour)
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+        .where(Reservation.status == 'Active', Reservation.end_time < cutoff)
+        .order_by(Reservation.end_time, Reservation.id)
+        .limit(batch_size)
+    ).all()
+    if not candidates:
+        return 0, 0, set()
+
+    # Claim the ones nobody released in the meantime
+    claimed = _update_changed(
+        update(Reservation).where(Reservation.status == 'Active').values(status='Expired'),
+        Reservation.id, [row.id for row in candidates]
+    )
+    expired = [row for row in candidates if row.id in claimed]
+    if not expired:
+        db.session.commit()
+        return len(candidates), 0, set()
+
+    charges = {row.id: expiry_cost(row.start_time, row.end_time, now, row.price_per_hour) for row in expired}
+    db.session.execute(update(Reservation), [
+        {'id': row.id, 'end_time': now, 'final_cost': charges[row.id]} for row in expired
+    ])
+
+    freed = _update_changed(
+        update(ParkingSpot).where(ParkingSpot.status == 'O').values(status='A'),
+        ParkingSpot.id, [row.spot_id for row in expired]
+    )
+    for lot_id, count in Counter(row.lot_id for row in expired if row.spot_id in freed).items():
+        adjust_lot_counts(lot_id, 'O', 'A', count)
+
+    record_releases(
+        (_Expired(row.user_id, row.start_time, now, charges[row.id]), row.lot_id) for row in expired
+    )
+    db.session.commit()
+    return len(candidates), len(expired), {row.user_id for row in expired}
+
+
+# One sweep: expire batches until nothing is overdue or the sweep has run for
+# `budget_ms`. Returns a report of what it did and how long each batch took.
+def sweep(now=None, batch_size=None, budget_ms=None):
+    now = now or datetime.utcnow()
+    batch_size = batch_size or app.config['EXPIRY_BATCH_SIZE']
+    budget_ms = app.config['EXPIRY_SWEEP_BUDGET_MS'] if budget_ms is None else budget_ms
+    cutoff = now - timedelta(minutes=app.config['EXPIRY_GRACE_MINUTES'])
+
+    report = {'expired': 0, 'batches': 0, 'batch_ms': [], 'elapsed_ms': 0.0, 'budget_exhausted': False}
+    started = time.perf_counter()
+    while True:
+        batch_started = time.perf_counter()
+        found, expired, users = _expire_batch(now, cutoff, batch_size)
+        if not found:
+            break
+        invalidate_user_stats(*users)
+        report['batches'] += 1
+        report['expired'] += expired
+        report['batch_ms'].append((time.perf_counter() - batch_started) * 1000)
+        report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+        if found < batch_size:
+            break
+        if budget_ms and report['elapsed_ms'] >= budget_ms:
+            report['budget_exhausted'] = True
+            break
+    report['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return report
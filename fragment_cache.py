@@ -0,0 +1,166 @@
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import select
+from app import app
+from models import db, ParkingLot
+from availability import lots_etag
+from metrics import inc
+
+
+# Rendered template fragments, cached in memory per process.
+#
+#   {% cache 'admin.view_lots', lots_version() %} ... {% endcache %}
+#
+# The arguments are the key: a fragment name, then whatever its output depends
+# on, typically a data version such as lots_version(). When the data changes
+# the version does, so the old entry is never asked for again and ages out of
+# the LRU. Entries also expire after FRAGMENT_CACHE_TTL seconds, which bounds
+# how long a change the versions do not see (or another process's invalidate())
+# can go unnoticed.
+#
+# The cache holds at most FRAGMENT_CACHE_MAX_BYTES of rendered text (0 turns
+# it off), least recently used out first. Views pass the data a fragment needs
+# wrapped in Deferred so its queries only run when the fragment is rendered.
+
+FragmentStats = namedtuple('FragmentStats', 'name hits misses')
+
+_entries = OrderedDict()  # key -> (expires at, markup, bytes)
+_lock = threading.Lock()
+_size = 0
+_evictions = 0
+_stats = {}  # fragment name -> [hits, misses]
+
+
+# Changes with any lot, spot or reservation: every booking, release and spot or
+# lot edit bumps its lot's occupancy_version (occupancy.py), and lots come and go
+def lots_version():
+    return lots_etag(db.session.execute(
+        select(ParkingLot.id, ParkingLot.created_on, ParkingLot.occupancy_version).order_by(ParkingLot.id)
+    ).all())
+
+
+# A value computed on first use, for data only a cached fragment needs
+class Deferred:
+    def __init__(self, load):
+        self._load = load
+        self._loaded = False
+        self._value = None
+
+    @property
+    def value(self):
+        if not self._loaded:
+            self._value = self._load()
+            self._loaded = True
+        return self._value
+
+    def __iter__(self):
+        return iter(self.value)
+
+    def __len__(self):
+        return len(self.value)
+
+    def __bool__(self):
+        return bool(self.value)
+
+    def __getitem__(self, key):
+        return self.value[key]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.value, name)
+
+
+def _count(name, result):
+    with _lock:
+        counts = _stats.setdefault(name, [0, 0])
+        counts[0 if result == 'hit' else 1] += 1
+    inc('fragment_cache_requests_total', name, result)
+
+
+def _evict(key):
+    global _size
+    _, _, size = _entries.pop(key)
+    _size -= size
+    inc('fragment_cache_bytes', value=-size)
+
+
+# The cached output for key, or render() stored under it
+def fragment(key, render):
+    global _size, _evictions
+    budget = app.config['FRAGMENT_CACHE_MAX_BYTES']
+    if budget <= 0:
+        return render()
+
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] > now:
+            _entries.move_to_end(key)
+    if entry is not None and entry[0] > now:
+        _count(key[0], 'hit')
+        return entry[1]
+
+    _count(key[0], 'miss')
+    markup = render()
+    size = sys.getsizeof(markup)
+    if size > budget:
+        return markup
+    with _lock:
+        if key in _entries:
+            _evict(key)
+        _entries[key] = (now + app.config['FRAGMENT_CACHE_TTL'], markup, size)
+        _size += size
+        inc('fragment_cache_bytes', value=size)
+        while _size > budget:
+            _evict(next(iter(_entries)))
+            _evictions += 1
+            inc('fragment_cache_evictions_total')
+    return markup
+
+
+# Drops every cached fragment of this process
+def invalidate():
+    with _lock:
+        for key in list(_entries):
+            _evict(key)
+
+
+def stats():
+    with _lock:
+        return {
+            'entries': len(_entries),
+            'bytes': _size,
+            'max_bytes': app.config['FRAGMENT_CACHE_MAX_BYTES'],
+            'evictions': _evictions,
+            'fragments': [FragmentStats(name, hits, misses) for name, (hits, misses) in sorted(_stats.items())],
+        }
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cached', [nodes.Tuple(key, 'load')]), [], [], body
+        ).set_lineno(lineno)
+
+    def _cached(self, key, caller):
+        return fragment(key, caller)
+
+
+def install():
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.globals['lots_version'] = lots_version
+
+
+install()
@@ -0,0 +1,395 @@
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import g, request
+from sqlalchemy import event, select
+from app import app
+from models import db, ParkingLot
+
+
+# Prometheus metrics, served in the text exposition format at /metrics.
+#
+# Recording is lock-free: every thread adds to its own shard of counters and
+# histogram buckets, so a request costs a couple of dict updates and no lock
+# (one short lock the first time a thread records anything). Shards are only
+# summed when /metrics is scraped; shards of finished threads are folded into
+# one retired shard then.
+#
+# Gauges that move up and down (requests in flight, pooled connections checked
+# out) are kept as +1/-1 counts. Lot occupancy comes from the lots' counters in
+# the database at scrape time.
+#
+# With several worker processes set METRICS_DIR to a directory they share:
+# each process writes its totals there every METRICS_FLUSH_INTERVAL seconds
+# (and on exit), and whichever worker is scraped adds up every process's file.
+# The file of a process that has exited is merged into one retired file (its
+# gauges dropped), so its counters keep counting without the directory growing
+# with every worker ever started.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CHECKOUT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by endpoint (blueprint.view), method and status.',
+                            ('endpoint', 'method', 'status'), None),
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint (blueprint.view).',
+                                      ('endpoint', 'method'), LATENCY_BUCKETS),
+    'http_requests_in_flight': ('gauge', 'Requests being handled, by endpoint.', ('endpoint',), None),
+    'parking_bookings_total': ('counter', 'Reservations booked.', (), None),
+    'parking_booking_failures_total': ('counter', 'Booking attempts turned down, by reason.', ('reason',), None),
+    'parking_releases_total': ('counter', 'Reservations released, by who released them.', ('by',), None),
+    'auth_logins_total': ('counter', 'Login attempts by result.', ('result',), None),
+    'db_pool_checkout_seconds': ('histogram', 'Time taken to get a database connection from the pool.',
+                                 (), CHECKOUT_BUCKETS),
+    'db_pool_connections_checked_out': ('gauge', 'Pooled database connections in use.', (), None),
+    'fragment_cache_requests_total': ('counter', 'Cached template fragment lookups by fragment and result (hit, miss).',
+                                      ('fragment', 'result'), None),
+    'fragment_cache_evictions_total': ('counter', 'Fragments dropped to stay within FRAGMENT_CACHE_MAX_BYTES.',
+                                       (), None),
+    'fragment_cache_bytes': ('gauge', 'Size of the cached template fragments.', (), None),
+}
+
+# Read from the database when scraped
+LOT_SPOTS_HELP = 'Spots per lot by status (available, occupied, maintenance).'
+
+
+class _Shard:
+    def __init__(self, thread=None):
+        self.thread = thread
+        self.counters = {}  # (name, label values) -> value
+        self.histograms = {}  # (name, label values) -> [count per bucket..., count over the last, sum]
+
+    # A copy that is safe to read while the owning thread keeps recording
+    def copy(self):
+        copy = _Shard()
+        copy.counters = dict(self.counters)
+        copy.histograms = {key: list(values) for key, values in list(self.histograms.items())}
+        return copy
+
+    def add(self, other):
+        for key, value in other.counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, values in other.histograms.items():
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    mine[i] += value
+
+
+_local = threading.local()
+_shards = []
+_retired = _Shard()
+_shards_lock = threading.Lock()
+
+
+def _shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _local.shard = _Shard(threading.current_thread())
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+# ---------------------------------------------------- RECORDING ----------------------------------------------------
+
+def inc(name, *labels, value=1):
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, value, *labels):
+    histograms = _shard().histograms
+    key = (name, labels)
+    counts = histograms.get(key)
+    if counts is None:
+        counts = histograms[key] = [0] * (len(METRICS[name][3]) + 1) + [0.0]
+    counts[bisect_left(METRICS[name][3], value)] += 1
+    counts[-1] += value
+
+
+def _start_request():
+    endpoint = request.endpoint or 'unmatched'
+    g.metrics = [time.perf_counter(), endpoint, 500]  # start, endpoint, status
+    inc('http_requests_in_flight', endpoint)
+    if _flusher_pid != os.getpid():
+        _ensure_flusher()
+
+
+def _record_status(response):
+    state = g.get('metrics')
+    if state:
+        state[2] = response.status_code
+    return response
+
+
+# Teardown also runs when the view raised, so the request is always counted
+def _finish_request(exc):
+    state = g.pop('metrics', None)
+    if state is None:
+        return
+    started, endpoint, status = state
+    method = request.method
+    inc('http_requests_in_flight', endpoint, value=-1)
+    inc('http_requests_total', endpoint, method, status)
+    observe('http_request_duration_seconds', time.perf_counter() - started, endpoint, method)
+
+
+def _timed_raw_connection(raw_connection):
+    def connect(*args, **kwargs):
+        started = time.perf_counter()
+        connection = raw_connection(*args, **kwargs)
+        observe('db_pool_checkout_seconds', time.perf_counter() - started)
+        return connection
+    return connect
+
+
+def _checked_out(dbapi_connection, connection_record, connection_proxy):
+    inc('db_pool_connections_checked_out')
+
+
+def _checked_in(dbapi_connection, connection_record):
+    inc('db_pool_connections_checked_out', value=-1)
+
+
+# ---------------------------------------------------- SNAPSHOTS ----------------------------------------------------
+
+# This process's totals, folding the shards of finished threads into one
+def _collect():
+    total = _Shard()
+    with _shards_lock:
+        for shard in [shard for shard in _shards if not shard.thread.is_alive()]:
+            _retired.add(shard)
+            _shards.remove(shard)
+        total.add(_retired)
+        live = list(_shards)
+    for shard in live:
+        total.add(shard.copy())
+    return total
+
+
+def _to_json(shard):
+    return {
+        'counters': [[name, list(labels), value] for (name, labels), value in shard.counters.items()],
+        'histograms': [[name, list(labels), values] for (name, labels), values in shard.histograms.items()],
+    }
+
+
+def _from_json(data, with_gauges):
+    shard = _Shard()
+    for name, labels, value in data['counters']:
+        if name in METRICS and (with_gauges or METRICS[name][0] != 'gauge'):
+            shard.counters[(name, tuple(labels))] = value
+    for name, labels, values in data['histograms']:
+        if name in METRICS:
+            shard.histograms[(name, tuple(labels))] = values
+    return shard
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _snapshot_path(directory, pid):
+    return os.path.join(directory, f'metrics-{pid}.json')
+
+
+_RETIRED_FILE = 'metrics-retired.json'
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_snapshot(path, data):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(path + '.tmp', path)
+
+
+# Scrapes read METRICS_DIR under a shared lock, merging dead processes' files
+# takes it exclusively, so no scrape sees a file both merged and still there
+@contextmanager
+def _directory_lock(directory, exclusive=False):
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# (pid, path) of the per-process snapshot files in directory
+def _process_snapshots(directory):
+    for entry in os.scandir(directory):
+        name = entry.name
+        if name.startswith('metrics-') and name.endswith('.json') and name[8:-5].isdigit():
+            yield int(name[8:-5]), entry.path
+
+
+# Fold the snapshot files of processes that have exited into the retired file
+def _retire_dead(directory):
+    if all(_process_alive(pid) for pid, _ in _process_snapshots(directory)):
+        return
+    with _directory_lock(directory, exclusive=True):
+        dead = [path for pid, path in _process_snapshots(directory) if not _process_alive(pid)]
+        if not dead:
+            return
+        retired_path = os.path.join(directory, _RETIRED_FILE)
+        retired = _Shard()
+        data = _read_snapshot(retired_path)
+        if data:
+            retired.add(_from_json(data, with_gauges=False))
+        for path in dead:
+            data = _read_snapshot(path)
+            if data:
+                retired.add(_from_json(data, with_gauges=False))
+        _write_snapshot(retired_path, _to_json(retired))
+        for path in dead:
+            os.remove(path)
+
+
+_flusher_pid = None
+
+
+# Write this process's totals to METRICS_DIR, if it has served requests
+def flush():
+    directory = app.config['METRICS_DIR']
+    if not directory or _flusher_pid != os.getpid():
+        return
+    _write_snapshot(_snapshot_path(directory, os.getpid()), _to_json(_collect()))
+
+
+# Starts the flush thread of this process (once per process, also after a fork)
+def _ensure_flusher():
+    global _flusher_pid
+    if not app.config['METRICS_DIR']:
+        return
+    with _shards_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+
+    def run():
+        while True:
+            time.sleep(app.config['METRICS_FLUSH_INTERVAL'])
+            flush()
+
+    threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+
+# A forked worker starts from zero; the parent's totals are its own
+def _forget_parent():
+    global _shards, _retired, _local, _shards_lock
+    _shards, _retired, _local, _shards_lock = [], _Shard(), threading.local(), threading.Lock()
+
+
+# Totals over every process writing to METRICS_DIR, this one counted live
+def totals():
+    total = _collect()
+    directory = app.config['METRICS_DIR']
+    if directory and os.path.isdir(directory):
+        _retire_dead(directory)
+        with _directory_lock(directory):
+            snapshots = [(path, True) for pid, path in _process_snapshots(directory) if pid != os.getpid()]
+            snapshots.append((os.path.join(directory, _RETIRED_FILE), False))
+            for path, with_gauges in snapshots:
+                data = _read_snapshot(path)
+                if data:
+                    total.add(_from_json(data, with_gauges=with_gauges))
+    return total
+
+
+# ---------------------------------------------------- EXPOSITION ---------------------------------------------------
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    total = totals()
+    by_name = {}
+    for (name, labels), value in total.counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), values in total.histograms.items():
+        by_name.setdefault(name, []).append((labels, values))
+
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        samples = by_name.get(name)
+        if not samples and not label_names:
+            # A series without labels exists from the start, so rate() and absent() work before it moves
+            samples = [((), [0] * (len(buckets) + 1) + [0.0] if kind == 'histogram' else 0)]
+        for labels, value in sorted(samples or (), key=lambda item: item[0]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for le, count in zip(buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(label_names, labels, [("le", _number(le))])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+
+    lines.append(f'# HELP parking_lot_spots {LOT_SPOTS_HELP}')
+    lines.append('# TYPE parking_lot_spots gauge')
+    lots = db.session.execute(select(
+        ParkingLot.id, ParkingLot.name, ParkingLot.available_count, ParkingLot.occupied_count,
+        ParkingLot.maintenance_count
+    ).order_by(ParkingLot.id)).all()
+    for lot_id, lot_name, available, occupied, maintenance in lots:
+        for status, count in (('available', available), ('occupied', occupied), ('maintenance', maintenance)):
+            labels = _labels(('lot_id', 'lot', 'status'), (lot_id, lot_name, status))
+            lines.append(f'parking_lot_spots{labels} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def install():
+    with app.app_context():
+        engine = db.engine
+    engine.raw_connection = _timed_raw_connection(engine.raw_connection)
+    event.listen(engine, 'checkout', _checked_out)
+    event.listen(engine, 'checkin', _checked_in)
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
+    os.register_at_fork(after_in_child=_forget_parent)
+    atexit.register(flush)
+
+
+install()
@@ -0,0 +1,60 @@
+from models import db
+
+
+# Bring an existing database up to the models in models.py.
+#
+# db.create_all() only creates missing tables, so this also adds missing
+# columns and indexes, then runs the data backfills that new structures need.
+# It is safe to run repeatedly; every step checks what is already there.
+# Returns a list of the changes made.
+def upgrade_schema():
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = []
+
+    # 1. New tables (with their indexes)
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            table.create(db.engine)
+            changes.append(f'table {table.name}')
+
+    # 2. New columns on existing tables
+    quote = db.engine.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in present:
+                continue
+            col_type = column.type.compile(dialect=db.engine.dialect)
+            ddl = f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {col_type}'
+            if column.server_default is not None:
+                ddl += f' DEFAULT {column.server_default.arg}'
+            with db.engine.begin() as conn:
+                conn.execute(db.text(ddl))
+            changes.append(f'column {table.name}.{column.name}')
+
+    # 3. New indexes on existing tables
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        present = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in present:
+                index.create(db.engine)
+                changes.append(f'index {index.name}')
+
+    # 4. Substring search index (FTS5 trigram on SQLite, pg_trgm on Postgres)
+    from search_index import setup_search_index
+    changes += setup_search_index()
+
+    # 5. Backfill data for new structures
+    if 'column parking_lot.available_count' in changes:
+        from occupancy import reconcile_lot_counts
+        reconcile_lot_counts()
+    if 'table daily_lot_stats' in changes and existing_tables:
+        from rollups import backfill_rollups
+        backfill_rollups()
+
+    return changes
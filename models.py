@@ -2,9 +2,13 @@ from app import app
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash
 from datetime import datetime
+from engine_profile import configure_engine
 
 db = SQLAlchemy(app)
 
+with app.app_context():
+    configure_engine(db.engine, app.config['DB_PROFILE'])
+
 
 # USER MODEL
 class User(db.Model):
@@ -14,7 +18,7 @@ class User(db.Model):
     password = db.Column(db.String(200), nullable=False)
     phone = db.Column(db.String(15))
     is_admin = db.Column(db.Boolean, default=False)
-    registered_on = db.Column(db.DateTime, default=datetime.utcnow)
+    registered_on = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_on = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     address_id = db.Column(db.Integer, db.ForeignKey('address.id'), nullable=True)
@@ -32,7 +36,7 @@ class Vehicle(db.Model):
     registered_on = db.Column(db.DateTime, default=datetime.utcnow)
     updated_on = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
 
 
 # ADDRESS MODEL
@@ -57,6 +61,17 @@ class ParkingLot(db.Model):
     created_on = db.Column(db.DateTime, default=datetime.utcnow)
     updated_on = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    # Denormalized spot counters, kept in step with ParkingSpot.status by occupancy.py
+    available_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    occupied_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    maintenance_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped whenever anything the availability API shows for the lot changes
+    occupancy_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    # Optional level/row/bay layout for spot numbering (provisioning.py); NULL = 1, 2, 3...
+    rows_per_level = db.Column(db.Integer)
+    bays_per_row = db.Column(db.Integer)
+
     address_id = db.Column(db.Integer, db.ForeignKey('address.id'), nullable=False)
     spots = db.relationship('ParkingSpot', backref='lot', cascade="all, delete")
 
@@ -65,35 +80,77 @@ class ParkingLot(db.Model):
 class ParkingSpot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     spot_number = db.Column(db.String(10), nullable=False)
-    status = db.Column(db.String(1), default='A')  # A: Available, O: Occupied
+    status = db.Column(db.String(1), default='A')  # A: Available, O: Occupied, M: Maintenance
     is_active = db.Column(db.Boolean, default=True)
     created_on = db.Column(db.DateTime, default=datetime.utcnow)
     updated_on = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
-    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
+    lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id', ondelete='CASCADE'), nullable=False)
     reservations = db.relationship('Reservation', backref='spot', lazy=True)
 
+    __table_args__ = (db.Index('ix_parking_spot_lot_status', 'lot_id', 'status'),)
+
 
 # RESERVATION MODEL
 class Reservation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.id'), nullable=False)
-    vehicle_plate = db.Column(db.String(16))  # For quick lookup
+    # ON DELETE rules back up the set-based deletes in provisioning.py
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    spot_id = db.Column(db.Integer, db.ForeignKey('parking_spot.id', ondelete='CASCADE'), nullable=False)
+    vehicle_plate = db.Column(db.String(16), index=True)  # For quick lookup
 
     status = db.Column(db.String(20), default='Active')  # Active, Released, Expired
-    start_time = db.Column(db.DateTime, default=datetime.utcnow)
-    end_time = db.Column(db.DateTime, nullable=True)
+    start_time = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    end_time = db.Column(db.DateTime, nullable=True, index=True)
     final_cost = db.Column(db.Float, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_reservation_user_status', 'user_id', 'status'),
+        db.Index('ix_reservation_user_start', 'user_id', 'start_time'),
+        db.Index('ix_reservation_spot_status', 'spot_id', 'status'),
+        db.Index('ix_reservation_status_end', 'status', 'end_time'),
+    )
+
+
+# DAILY LOT STATS (rollup kept current by rollups.py)
+# lot_id is not a foreign key so history survives lot deletion
+class DailyLotStats(db.Model):
+    __tablename__ = 'daily_lot_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    lot_id = db.Column(db.Integer, nullable=False)
+    bookings = db.Column(db.Integer, nullable=False, default=0)  # by start day
+    revenue = db.Column(db.Float, nullable=False, default=0.0)  # by release day
+    hours_parked = db.Column(db.Float, nullable=False, default=0.0)  # by release day
+
+    __table_args__ = (db.UniqueConstraint('day', 'lot_id'),)
+
+
+# DAILY USER STATS (rollup kept current by rollups.py)
+class DailyUserStats(db.Model):
+    __tablename__ = 'daily_user_stats'
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    registered = db.Column(db.Integer, nullable=False, default=0)  # 1 on the registration day
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    spent = db.Column(db.Float, nullable=False, default=0.0)
+    hours_parked = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (db.UniqueConstraint('day', 'user_id'),)
+
 
 # CREATE ADMIN IF NOT EXISTS
 with app.app_context():
-    db.create_all()
+    from migrations import upgrade_schema
+    upgrade_schema()
     admin = User.query.filter_by(is_admin=True).first()
     if not admin:
         password_hash = generate_password_hash('admin')
         admin = User(full_name='Admin',email='admin@gmail.com',password=password_hash,is_admin=True)
         db.session.add(admin)
+        db.session.flush()
+        from rollups import record_registration
+        record_registration(admin)
         db.session.commit()
@@ -0,0 +1,78 @@
+from sqlalchemy import func, update
+from models import db, ParkingLot, ParkingSpot
+from spot_index import record_change
+
+
+# Spot status -> ParkingLot counter column
+STATUS_COUNTERS = {
+    'A': 'available_count',
+    'O': 'occupied_count',
+    'M': 'maintenance_count',
+}
+
+
+# Adjust the lot counters for `count` spots moving from old_status to new_status.
+# Runs as an UPDATE in the current session so it commits with the spot change,
+# and bumps the lot's occupancy_version.
+# Pass spot_id for a single known spot; otherwise the lot's in-memory spot index
+# is dropped and rebuilt on next use.
+def adjust_lot_counts(lot_id, old_status=None, new_status=None, count=1, spot_id=None):
+    record_change(lot_id, spot_id, new_status)
+    if old_status == new_status or count == 0:
+        return
+    values = {}
+    if old_status in STATUS_COUNTERS:
+        column = getattr(ParkingLot, STATUS_COUNTERS[old_status])
+        values[column] = column - count
+    if new_status in STATUS_COUNTERS:
+        column = getattr(ParkingLot, STATUS_COUNTERS[new_status])
+        values[column] = column + count
+    if values:
+        values[ParkingLot.occupancy_version] = ParkingLot.occupancy_version + 1
+        db.session.execute(
+            update(ParkingLot).where(ParkingLot.id == lot_id).values(values),
+            execution_options={'synchronize_session': 'fetch'}
+        )
+
+
+# Bump a lot's occupancy_version for changes that move no counter (a spot
+# renamed, the lot renamed or repriced) so availability ETags change too
+def touch_lot(lot_id):
+    db.session.execute(
+        update(ParkingLot).where(ParkingLot.id == lot_id)
+        .values({ParkingLot.occupancy_version: ParkingLot.occupancy_version + 1}),
+        execution_options={'synchronize_session': 'fetch'}
+    )
+
+
+# Change a spot's status and keep its lot counters in step
+def set_spot_status(spot, new_status):
+    old_status = spot.status
+    spot.status = new_status
+    adjust_lot_counts(spot.lot_id, old_status, new_status, spot_id=spot.id)
+
+
+# Recompute every lot's counters from ParkingSpot and report the drift found.
+# Returns a list of {'lot_id', 'column', 'stored', 'actual'} dicts.
+def reconcile_lot_counts(fix=True):
+    actual = {}
+    rows = db.session.query(
+        ParkingSpot.lot_id, ParkingSpot.status, func.count(ParkingSpot.id)
+    ).group_by(ParkingSpot.lot_id, ParkingSpot.status).all()
+    for lot_id, status, count in rows:
+        if status in STATUS_COUNTERS:
+            actual[(lot_id, STATUS_COUNTERS[status])] = count
+
+    drift = []
+    for lot in ParkingLot.query.all():
+        for column in STATUS_COUNTERS.values():
+            stored = getattr(lot, column) or 0
+            expected = actual.get((lot.id, column), 0)
+            if stored != expected:
+                drift.append({'lot_id': lot.id, 'column': column, 'stored': stored, 'actual': expected})
+                if fix:
+                    setattr(lot, column, expected)
+
+    if fix and drift:
+        db.session.commit()
+    return drift
@@ -0,0 +1,94 @@
+from datetime import datetime
+from flask import request, url_for
+from sqlalchemy import and_, func, or_, select
+from app import app
+from models import db
+
+
+# Keyset (cursor) pagination, newest first, over a (timestamp, id) pair.
+#
+# Pages are addressed by the last/first row seen instead of an OFFSET, so page N
+# costs the same index range scan as page 1. Cursors look like
+# "2025-06-01T09:30:00_1234" and travel in the ?after= / ?before= arguments.
+class KeysetPage:
+    def __init__(self, items, has_next, has_prev, sort_attr, total=None, total_capped=False):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+        self.total_capped = total_capped
+        self.next_cursor = encode_cursor(getattr(items[-1], sort_attr), items[-1].id) if has_next and items else None
+        self.prev_cursor = encode_cursor(getattr(items[0], sort_attr), items[0].id) if has_prev and items else None
+
+    # Link to the older ('next') or newer ('prev') page keeping the current
+    # filters; with no direction, links to this page with `values` changed
+    def url(self, endpoint, direction=None, **values):
+        args = request.args.to_dict()
+        if direction == 'next':
+            args.pop('before', None)
+            args['after'] = self.next_cursor
+        elif direction == 'prev':
+            args.pop('after', None)
+            args['before'] = self.prev_cursor
+        args.update(values)
+        return url_for(endpoint, **args)
+
+
+def encode_cursor(timestamp, row_id):
+    return f'{timestamp.isoformat()}_{row_id}'
+
+
+# Returns (timestamp, id), or None for a missing or malformed cursor
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        timestamp, row_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        return None
+
+
+def page_size():
+    default = app.config['PAGE_SIZE']
+    size = request.args.get('per_page', default, type=int)
+    return max(1, min(size, app.config['MAX_PAGE_SIZE']))
+
+
+# Count the filtered rows, stopping at `cap` so the count stays cheap.
+# Returns (count, capped).
+def approximate_count(query, cap):
+    limited = query.enable_eagerloads(False).order_by(None).limit(cap + 1).subquery()
+    count = db.session.execute(select(func.count()).select_from(limited)).scalar()
+    return min(count, cap), count > cap
+
+
+# Paginate `query` newest first on (sort_column, id_column) using the
+# ?after= / ?before= cursors from the request.
+def keyset_paginate(query, sort_column, id_column, per_page=None, with_total=False):
+    per_page = per_page or page_size()
+    after = decode_cursor(request.args.get('after'))
+    before = decode_cursor(request.args.get('before'))
+
+    if before:
+        stamp, row_id = before
+        rows = query.filter(or_(sort_column > stamp, and_(sort_column == stamp, id_column > row_id)))\
+            .order_by(sort_column.asc(), id_column.asc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after:
+            stamp, row_id = after
+            query_page = query.filter(or_(sort_column < stamp, and_(sort_column == stamp, id_column < row_id)))
+        else:
+            query_page = query
+        rows = query_page.order_by(sort_column.desc(), id_column.desc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = after is not None
+
+    total, capped = None, False
+    if with_total:
+        total, capped = approximate_count(query, app.config['PAGE_COUNT_CAP'])
+    return KeysetPage(items, has_next, has_prev, sort_column.key, total, capped)
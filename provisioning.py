@@ -0,0 +1,136 @@
+import string
+from sqlalchemy import delete, exists, insert, select
+from models import db, User, Vehicle, ParkingLot, ParkingSpot, Reservation
+from occupancy import adjust_lot_counts
+from spot_index import record_change
+from stats import invalidate_user_stats
+from decorators import invalidate_principal
+
+
+# Bulk creation and removal of spots, lots and users.
+#
+# Spots are inserted as plain rows in batches (one executemany each) inside the
+# caller's transaction, and the lot's counters move once for the whole batch,
+# so a 20,000-spot garage costs a few statements instead of 20,000 ORM flushes.
+# Removal is the same: a fixed handful of DELETEs however big the lot is.
+#
+# Reservation history policy: a spot with reservations is never removed on its
+# own (shrinking a lot skips it, as admin_delete_spot refuses it). Deleting a
+# whole lot or user removes its released history too, the daily rollups keep
+# the totals, but is refused while any of its reservations is still Active.
+
+INSERT_BATCH = 1000
+
+# spot_number is String(10): "L99-ZZ999" is the longest structured number
+MAX_LEVELS = 99
+MAX_ROWS = 26 * 27
+MAX_BAYS = 999
+
+
+def _row_label(row):
+    # 0 -> A ... 25 -> Z, 26 -> AA ...
+    letters = string.ascii_uppercase
+    return letters[row] if row < 26 else letters[row // 26 - 1] + letters[row % 26]
+
+
+# The nth spot number (0-based) for a lot. Flat lots are numbered 1, 2, 3...;
+# lots with a layout are numbered level/row/bay, e.g. "L2-B014" for level 2,
+# row B, bay 14.
+def spot_number(n, rows_per_level=None, bays_per_row=None):
+    if not rows_per_level or not bays_per_row:
+        return str(n + 1)
+    level, rest = divmod(n, rows_per_level * bays_per_row)
+    row, bay = divmod(rest, bays_per_row)
+    return f'L{level + 1}-{_row_label(row)}{bay + 1:03d}'
+
+
+# Raises ValueError unless every spot of a `count`-spot lot gets a number
+def check_layout(count, rows_per_level=None, bays_per_row=None):
+    if not rows_per_level and not bays_per_row:
+        return
+    if not rows_per_level or not bays_per_row:
+        raise ValueError('Give both rows per level and bays per row, or neither.')
+    if not 1 <= rows_per_level <= MAX_ROWS or not 1 <= bays_per_row <= MAX_BAYS:
+        raise ValueError(f'Rows per level must be 1-{MAX_ROWS} and bays per row 1-{MAX_BAYS}.')
+    if count > MAX_LEVELS * rows_per_level * bays_per_row:
+        raise ValueError(f'{count} spots need more than {MAX_LEVELS} levels with this layout.')
+
+
+# Add `count` available spots to `lot`, continuing its numbering and skipping
+# numbers already in use. Does not commit. Returns the number of spots added.
+def provision_spots(lot, count, batch_size=INSERT_BATCH):
+    if count <= 0:
+        return 0
+    check_layout(count, lot.rows_per_level, lot.bays_per_row)
+    taken = set(db.session.execute(
+        select(ParkingSpot.spot_number).where(ParkingSpot.lot_id == lot.id)
+    ).scalars())
+
+    rows = []
+    n = 0
+    while len(rows) < count:
+        number = spot_number(n, lot.rows_per_level, lot.bays_per_row)
+        n += 1
+        if number not in taken:
+            rows.append({'spot_number': number, 'lot_id': lot.id, 'status': 'A', 'is_active': True})
+
+    for start in range(0, count, batch_size):
+        db.session.execute(insert(ParkingSpot), rows[start:start + batch_size])
+    adjust_lot_counts(lot.id, None, 'A', count)
+    return count
+
+
+# Remove up to `count` free spots without reservation history from `lot`,
+# highest numbered first. Does not commit. Returns the number removed.
+def shrink_lot(lot, count):
+    if count <= 0:
+        return 0
+    removable = select(ParkingSpot.id).where(
+        ParkingSpot.lot_id == lot.id,
+        ParkingSpot.status == 'A',
+        ~exists().where(Reservation.spot_id == ParkingSpot.id)
+    ).order_by(ParkingSpot.id.desc()).limit(count)
+    removed = db.session.execute(
+        # status is checked again in case a spot was booked since the subquery ran
+        delete(ParkingSpot).where(ParkingSpot.id.in_(removable), ParkingSpot.status == 'A'),
+        execution_options={'synchronize_session': False}
+    ).rowcount
+    adjust_lot_counts(lot.id, 'A', None, removed)
+    return removed
+
+
+def _active_reservations(*criteria):
+    return db.session.query(exists().where(Reservation.status == 'Active', *criteria)).scalar()
+
+
+# Delete a lot with its spots and their reservation history. Does not commit.
+# Returns False (and deletes nothing) while the lot has Active reservations.
+def remove_lot(lot_id):
+    lot_spots = select(ParkingSpot.id).where(ParkingSpot.lot_id == lot_id)
+    if _active_reservations(Reservation.spot_id.in_(lot_spots)):
+        return False
+    affected_users = db.session.execute(
+        select(Reservation.user_id).where(Reservation.spot_id.in_(lot_spots)).distinct()
+    ).scalars().all()
+
+    unsynchronized = {'synchronize_session': False}
+    db.session.execute(delete(Reservation).where(Reservation.spot_id.in_(lot_spots)), execution_options=unsynchronized)
+    db.session.execute(delete(ParkingSpot).where(ParkingSpot.lot_id == lot_id), execution_options=unsynchronized)
+    db.session.execute(delete(ParkingLot).where(ParkingLot.id == lot_id), execution_options=unsynchronized)
+    record_change(lot_id)
+    invalidate_user_stats(*affected_users)
+    return True
+
+
+# Delete a user with their vehicles and reservation history. Does not commit.
+# Returns False (and deletes nothing) while the user has an Active reservation.
+def remove_user(user_id):
+    if _active_reservations(Reservation.user_id == user_id):
+        return False
+    unsynchronized = {'synchronize_session': False}
+    db.session.execute(delete(Reservation).where(Reservation.user_id == user_id), execution_options=unsynchronized)
+    db.session.execute(delete(Vehicle).where(Vehicle.user_id == user_id), execution_options=unsynchronized)
+    db.session.execute(delete(User).where(User.id == user_id), execution_options=unsynchronized)
+    invalidate_user_stats(user_id)
+    invalidate_principal(user_id)
+    return True
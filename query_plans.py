@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from models import db, User, ParkingSpot, Reservation
+
+
+# The query shapes on the hot paths, each of which must be served by an index
+def hot_queries():
+    now = datetime.utcnow()
+    return {
+        'reservations by user and status': select(Reservation.id).where(
+            Reservation.user_id == 1, Reservation.status == 'Active'),
+        'reservations by start time': select(Reservation.id).where(
+            Reservation.start_time >= now - timedelta(days=7)),
+        'reservations by end time': select(Reservation.id).where(
+            Reservation.end_time.between(now - timedelta(days=7), now)),
+        'overdue active reservations': select(Reservation.id).where(
+            Reservation.status == 'Active', Reservation.end_time < now).order_by(Reservation.end_time),
+        'reservations by spot and status': select(Reservation.id).where(
+            Reservation.spot_id == 1, Reservation.status == 'Active'),
+        'reservations by vehicle plate': select(Reservation.id).where(
+            Reservation.vehicle_plate == 'MH12AB1234'),
+        'free spots in lot': select(ParkingSpot.id).where(
+            ParkingSpot.lot_id == 1, ParkingSpot.status == 'A'),
+        'users by registration date': select(User.id).where(
+            User.registered_on >= now - timedelta(days=30)),
+    }
+
+
+def _explain(conn, stmt):
+    compiled = stmt.compile(dialect=conn.dialect)
+    if conn.dialect.name == 'sqlite':
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).all()
+        return [row[-1] for row in rows]
+    rows = conn.exec_driver_sql('EXPLAIN ' + str(compiled), compiled.params).all()
+    return [row[0] for row in rows]
+
+
+def _is_full_scan(dialect, line):
+    if dialect == 'sqlite':
+        # "SCAN reservation" reads the whole table; "SEARCH ... USING INDEX" does not
+        return line.startswith('SCAN ') and 'USING' not in line
+    return 'Seq Scan' in line
+
+
+# EXPLAIN every hot query; returns {name: plan lines} for the ones that fall
+# back to a full table scan.
+def check_query_plans():
+    failures = {}
+    with db.engine.connect() as conn:
+        if conn.dialect.name == 'postgresql':
+            # Small tables make the planner prefer a seq scan even with an index
+            conn.exec_driver_sql('SET enable_seqscan = off')
+        for name, stmt in hot_queries().items():
+            plan = _explain(conn, stmt)
+            if any(_is_full_scan(conn.dialect.name, line) for line in plan):
+                failures[name] = plan
+    return failures
@@ -0,0 +1,178 @@
+from collections import defaultdict
+from datetime import date, datetime, time
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, User, ParkingLot, ParkingSpot, Reservation, DailyLotStats, DailyUserStats
+
+
+# ----------------------------------------------------- WRITES -----------------------------------------------------
+
+# Add `increments` to the rollup row identified by `keys`, creating it if needed.
+# Runs in the current session so it commits together with the booking/release.
+def _bump(model, keys, increments):
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert_fn = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = insert_fn(model).values(**keys, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in increments}
+        )
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(
+        update(model).filter_by(**keys).values(
+            {getattr(model, name): getattr(model, name) + value for name, value in increments.items()}
+        ),
+        execution_options={'synchronize_session': False}
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(model).values(**keys, **increments))
+
+
+def _day(value):
+    return (value or datetime.utcnow()).date()
+
+
+def record_booking(reservation, lot_id):
+    day = _day(reservation.start_time)
+    _bump(DailyLotStats, {'day': day, 'lot_id': lot_id}, {'bookings': 1})
+    _bump(DailyUserStats, {'day': day, 'user_id': reservation.user_id}, {'bookings': 1})
+
+
+def record_release(reservation, lot_id):
+    day = _day(reservation.end_time)
+    cost = reservation.final_cost or 0.0
+    hours = (reservation.end_time - reservation.start_time).total_seconds() / 3600
+    _bump(DailyLotStats, {'day': day, 'lot_id': lot_id}, {'revenue': cost, 'hours_parked': hours})
+    _bump(DailyUserStats, {'day': day, 'user_id': reservation.user_id}, {'spent': cost, 'hours_parked': hours})
+
+
+# record_release for many reservations at once (e.g. an expiry sweep): `releases`
+# is an iterable of (reservation, lot_id); one upsert per day and lot/user.
+def record_releases(releases):
+    by_lot, by_user = defaultdict(lambda: [0.0, 0.0]), defaultdict(lambda: [0.0, 0.0])
+    for reservation, lot_id in releases:
+        day = _day(reservation.end_time)
+        cost = reservation.final_cost or 0.0
+        hours = (reservation.end_time - reservation.start_time).total_seconds() / 3600
+        for totals in (by_lot[(day, lot_id)], by_user[(day, reservation.user_id)]):
+            totals[0] += cost
+            totals[1] += hours
+    for (day, lot_id), (cost, hours) in by_lot.items():
+        _bump(DailyLotStats, {'day': day, 'lot_id': lot_id}, {'revenue': cost, 'hours_parked': hours})
+    for (day, user_id), (cost, hours) in by_user.items():
+        _bump(DailyUserStats, {'day': day, 'user_id': user_id}, {'spent': cost, 'hours_parked': hours})
+
+
+def record_registration(user):
+    _bump(DailyUserStats, {'day': _day(user.registered_on), 'user_id': user.id}, {'registered': 1})
+
+
+# ---------------------------------------------------- BACKFILL ----------------------------------------------------
+
+def _as_date(value):
+    # func.date() gives a string on SQLite and a date elsewhere
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+# SQL expression for the hours between two datetime columns
+def hours_between(start, end):
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(end) - func.julianday(start)) * 24
+    return func.extract('epoch', end - start) / 3600
+
+
+# Rebuild both rollup tables from Reservation and User, from `since` (a date)
+# onwards or from scratch. Returns the number of rows written per table.
+def backfill_rollups(since=None):
+    since_day = since
+    if since:
+        since = datetime.combine(since, time.min)
+    lot_rows = {}
+    user_rows = {}
+
+    def add(rows, key, **values):
+        row = rows.setdefault(key, {})
+        for name, value in values.items():
+            row[name] = row.get(name, 0) + (value or 0)
+
+    start_day = func.date(Reservation.start_time)
+    bookings = db.session.query(
+        start_day, ParkingSpot.lot_id, Reservation.user_id, func.count(Reservation.id)
+    ).join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+    if since:
+        bookings = bookings.filter(Reservation.start_time >= since)
+    for day, lot_id, user_id, count in bookings.group_by(start_day, ParkingSpot.lot_id, Reservation.user_id):
+        add(lot_rows, (_as_date(day), lot_id), bookings=count)
+        add(user_rows, (_as_date(day), user_id), bookings=count)
+
+    end_day = func.date(Reservation.end_time)
+    releases = db.session.query(
+        end_day, ParkingSpot.lot_id, Reservation.user_id,
+        func.sum(Reservation.final_cost), func.sum(hours_between(Reservation.start_time, Reservation.end_time))
+    ).join(ParkingSpot, Reservation.spot_id == ParkingSpot.id)\
+     .filter(Reservation.status != 'Active', Reservation.end_time.isnot(None))
+    if since:
+        releases = releases.filter(Reservation.end_time >= since)
+    for day, lot_id, user_id, cost, hours in releases.group_by(end_day, ParkingSpot.lot_id, Reservation.user_id):
+        add(lot_rows, (_as_date(day), lot_id), revenue=cost, hours_parked=hours)
+        add(user_rows, (_as_date(day), user_id), spent=cost, hours_parked=hours)
+
+    registered_day = func.date(User.registered_on)
+    registrations = db.session.query(registered_day, User.id).filter(User.registered_on.isnot(None))
+    if since:
+        registrations = registrations.filter(User.registered_on >= since)
+    for day, user_id in registrations:
+        add(user_rows, (_as_date(day), user_id), registered=1)
+
+    for model in (DailyLotStats, DailyUserStats):
+        stale = db.session.query(model)
+        if since:
+            stale = stale.filter(model.day >= since_day)
+        stale.delete(synchronize_session=False)
+
+    if lot_rows:
+        db.session.execute(insert(DailyLotStats), [
+            {'day': day, 'lot_id': lot_id, 'bookings': 0, 'revenue': 0.0, 'hours_parked': 0.0, **values}
+            for (day, lot_id), values in lot_rows.items()
+        ])
+    if user_rows:
+        db.session.execute(insert(DailyUserStats), [
+            {'day': day, 'user_id': user_id, 'registered': 0, 'bookings': 0, 'spent': 0.0, 'hours_parked': 0.0, **values}
+            for (day, user_id), values in user_rows.items()
+        ])
+    db.session.commit()
+    return {'daily_lot_stats': len(lot_rows), 'daily_user_stats': len(user_rows)}
+
+
+# ----------------------------------------------------- READS ------------------------------------------------------
+
+# {date: revenue} for first_day..last_day (inclusive)
+def revenue_by_day(first_day, last_day):
+    rows = db.session.query(DailyLotStats.day, func.sum(DailyLotStats.revenue))\
+        .filter(DailyLotStats.day.between(first_day, last_day))\
+        .group_by(DailyLotStats.day).all()
+    return {day: float(total or 0) for day, total in rows}
+
+
+# [(lot name, bookings)] for every current lot, in lot id order
+def bookings_by_lot(only_booked=False):
+    query = db.session.query(ParkingLot.name, func.coalesce(func.sum(DailyLotStats.bookings), 0))
+    if only_booked:
+        query = query.join(DailyLotStats, DailyLotStats.lot_id == ParkingLot.id)
+    else:
+        query = query.outerjoin(DailyLotStats, DailyLotStats.lot_id == ParkingLot.id)
+    return query.group_by(ParkingLot.id, ParkingLot.name).order_by(ParkingLot.id).all()
+
+
+# {date: registrations} from first_day onwards
+def registrations_by_day(first_day):
+    rows = db.session.query(DailyUserStats.day, func.sum(DailyUserStats.registered))\
+        .filter(DailyUserStats.day >= first_day, DailyUserStats.registered > 0)\
+        .group_by(DailyUserStats.day).all()
+    return {day: int(total) for day, total in rows}
+
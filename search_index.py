@@ -0,0 +1,248 @@
+import re
+from contextlib import contextmanager
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import contains_eager
+from app import app
+from models import db, User, Address, ParkingLot, Reservation
+
+
+# Substring search over reservation plates and user name/email/phone, and
+# word search over lot addresses.
+#
+# SQLite: FTS5 tables kept in sync with the base tables by triggers (trigram
+# tokenizer for substrings, word tokenizer with prefix indexes for lots).
+# Postgres: pg_trgm GIN indexes, which ILIKE '%q%' uses directly. Anywhere
+# else, or for terms shorter than a trigram, searches fall back to ILIKE.
+
+MIN_TERM_LENGTH = 3
+
+SQLITE_DDL = {}
+
+SQLITE_DDL['reservation_fts'] = [
+    "CREATE VIRTUAL TABLE reservation_fts USING fts5(vehicle_plate, tokenize='trigram')",
+    """CREATE TRIGGER reservation_fts_insert AFTER INSERT ON reservation BEGIN
+        INSERT INTO reservation_fts(rowid, vehicle_plate) VALUES (new.id, new.vehicle_plate);
+    END""",
+    """CREATE TRIGGER reservation_fts_update AFTER UPDATE OF vehicle_plate ON reservation BEGIN
+        UPDATE reservation_fts SET vehicle_plate = new.vehicle_plate WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER reservation_fts_delete AFTER DELETE ON reservation BEGIN
+        DELETE FROM reservation_fts WHERE rowid = old.id;
+    END""",
+    "INSERT INTO reservation_fts(rowid, vehicle_plate) SELECT id, vehicle_plate FROM reservation",
+]
+
+SQLITE_DDL['user_fts'] = [
+    "CREATE VIRTUAL TABLE user_fts USING fts5(full_name, email, phone, tokenize='trigram')",
+    """CREATE TRIGGER user_fts_insert AFTER INSERT ON "user" BEGIN
+        INSERT INTO user_fts(rowid, full_name, email, phone) VALUES (new.id, new.full_name, new.email, new.phone);
+    END""",
+    """CREATE TRIGGER user_fts_update AFTER UPDATE OF full_name, email, phone ON "user" BEGIN
+        UPDATE user_fts SET full_name = new.full_name, email = new.email, phone = new.phone WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER user_fts_delete AFTER DELETE ON "user" BEGIN
+        DELETE FROM user_fts WHERE rowid = old.id;
+    END""",
+    'INSERT INTO user_fts(rowid, full_name, email, phone) SELECT id, full_name, email, phone FROM "user"',
+]
+
+# One row per lot (rowid = lot id) holding the lot name and its address.
+# Words are indexed with 2- and 3-character prefix indexes so "pincode prefix"
+# and "start of a word" queries stay index lookups.
+_LOT_ROW = """SELECT l.id, l.name, a.address, a.city, a.landmark, a.pincode
+        FROM parking_lot l JOIN address a ON a.id = l.address_id"""
+
+SQLITE_DDL['lot_fts'] = [
+    """CREATE VIRTUAL TABLE lot_fts USING fts5(name, address, city, landmark, pincode,
+        tokenize='unicode61', prefix='2 3')""",
+
+    f"""CREATE TRIGGER lot_fts_insert AFTER INSERT ON parking_lot BEGIN
+        INSERT INTO lot_fts(rowid, name, address, city, landmark, pincode) {_LOT_ROW} WHERE l.id = new.id;
+    END""",
+    f"""CREATE TRIGGER lot_fts_update AFTER UPDATE OF name, address_id ON parking_lot BEGIN
+        DELETE FROM lot_fts WHERE rowid = old.id;
+        INSERT INTO lot_fts(rowid, name, address, city, landmark, pincode) {_LOT_ROW} WHERE l.id = new.id;
+    END""",
+    """CREATE TRIGGER lot_fts_delete AFTER DELETE ON parking_lot BEGIN
+        DELETE FROM lot_fts WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER lot_fts_address_update AFTER UPDATE ON address BEGIN
+        DELETE FROM lot_fts WHERE rowid IN (SELECT id FROM parking_lot WHERE address_id = new.id);
+        INSERT INTO lot_fts(rowid, name, address, city, landmark, pincode) {_LOT_ROW} WHERE a.id = new.id;
+    END""",
+
+    f'INSERT INTO lot_fts(rowid, name, address, city, landmark, pincode) {_LOT_ROW}',
+]
+
+POSTGRES_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_reservation_plate_trgm ON reservation USING gin (vehicle_plate gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_user_full_name_trgm ON "user" USING gin (full_name gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_user_email_trgm ON "user" USING gin (email gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_user_phone_trgm ON "user" USING gin (phone gin_trgm_ops)',
+]
+
+
+def _sqlite_has_table(conn, name):
+    return conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).first() is not None
+
+
+# Create the search index for the current database if it is missing.
+# Called from migrations.upgrade_schema(); returns a list of changes made.
+def setup_search_index():
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        changes = []
+        for table, statements in SQLITE_DDL.items():
+            try:
+                with db.engine.begin() as conn:
+                    if _sqlite_has_table(conn, table):
+                        continue
+                    for ddl in statements:
+                        conn.exec_driver_sql(ddl)
+            except Exception as exc:
+                # e.g. SQLite older than 3.34 has no trigram tokenizer; stay on ILIKE
+                app.logger.warning('Search index %s not created: %s', table, exc)
+                continue
+            changes.append(f'search index {table}')
+        _fts_ready.clear()
+        return changes
+    if dialect == 'postgresql':
+        try:
+            with db.engine.begin() as conn:
+                for ddl in POSTGRES_DDL:
+                    conn.exec_driver_sql(ddl)
+        except Exception as exc:
+            # pg_trgm needs a superuser or a trusted extension; stay on ILIKE
+            app.logger.warning('Search index not created: %s', exc)
+            return []
+        return ['search index pg_trgm']
+    return []
+
+
+# Bulk loads: (index, insert trigger, catch-up statement) for tables whose
+# index can be filled in one pass after the rows are in, instead of per row
+_DEFERRABLE = {
+    'reservation': ('reservation_fts', SQLITE_DDL['reservation_fts'][1],
+                    'INSERT INTO reservation_fts(rowid, vehicle_plate) '
+                    'SELECT id, vehicle_plate FROM reservation WHERE id > ?'),
+    'user': ('user_fts', SQLITE_DDL['user_fts'][1],
+             'INSERT INTO user_fts(rowid, full_name, email, phone) '
+             'SELECT id, full_name, email, phone FROM "user" WHERE id > ?'),
+}
+
+
+# Insert many rows into `table` (reservation or user) inside the block, in the
+# current session's transaction, without the index trigger firing per row; the
+# new rows are indexed in one statement when the block ends. Only for bulk
+# loads that run with no other writers.
+@contextmanager
+def deferred_index(table):
+    index, create_trigger, catch_up = _DEFERRABLE[table]
+    conn = db.session.connection()
+    if conn.dialect.name != 'sqlite' or not _sqlite_has_table(conn, index):
+        yield
+        return
+    last_id = conn.exec_driver_sql(f'SELECT coalesce(max(id), 0) FROM "{table}"').scalar()
+    conn.exec_driver_sql(f'DROP TRIGGER {index}_insert')
+    try:
+        yield
+    except BaseException:
+        # pysqlite opens transactions only for DML, so the DROP may already
+        # be committed: roll the rows back and make sure the trigger is there
+        db.session.rollback()
+        db.session.connection().exec_driver_sql(create_trigger.replace('TRIGGER', 'TRIGGER IF NOT EXISTS', 1))
+        db.session.commit()
+        raise
+    conn.exec_driver_sql(catch_up, (last_id,))
+    conn.exec_driver_sql(create_trigger)
+
+
+_fts_ready = {}
+
+
+def _has_fts(table):
+    if not app.config['SEARCH_INDEX_ENABLED'] or db.engine.dialect.name != 'sqlite':
+        return False
+    key = (db.engine.url, table)
+    if key not in _fts_ready:
+        with db.engine.connect() as conn:
+            _fts_ready[key] = _sqlite_has_table(conn, table)
+    return _fts_ready[key]
+
+
+def _use_fts(term, table='reservation_fts'):
+    return len(term) >= MIN_TERM_LENGTH and _has_fts(table)
+
+
+def _match_phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _matching_user_ids(term, columns):
+    return text(
+        'SELECT rowid FROM user_fts WHERE user_fts MATCH :users_q'
+    ).bindparams(users_q='{' + ' '.join(columns) + '}: ' + _match_phrase(term))
+
+
+# Criterion for view_reservations' search box: plate, user email or user name.
+# Returns (criterion, needs_user_join).
+def reservation_search(term):
+    if _use_fts(term):
+        plates = text('SELECT rowid FROM reservation_fts WHERE reservation_fts MATCH :plates_q')\
+            .bindparams(plates_q=_match_phrase(term))
+        return or_(
+            Reservation.id.in_(plates),
+            Reservation.user_id.in_(_matching_user_ids(term, ['full_name', 'email']))
+        ), False
+    return or_(
+        Reservation.vehicle_plate.ilike(f'%{term}%'),
+        User.email.ilike(f'%{term}%'),
+        User.full_name.ilike(f'%{term}%')
+    ), True
+
+
+# Criterion for manage_users' search box: name, email or phone
+def user_search(term):
+    if _use_fts(term, 'user_fts'):
+        return User.id.in_(_matching_user_ids(term, ['full_name', 'email', 'phone']))
+    return (
+        (User.full_name.ilike(f'%{term}%')) |
+        (User.email.ilike(f'%{term}%')) |
+        (User.phone.ilike(f'%{term}%'))
+    )
+
+
+# Characters a word can follow inside a text, for the LIKE fallback of word
+# prefix matching (the FTS tokenizer splits on any of them)
+_WORD_BREAKS = (' ', ',', '-', '/', '.', '(')
+
+
+# `column` has a word starting with `word`, without an FTS index
+def _word_prefix(column, word):
+    return or_(column.istartswith(word, autoescape=True),
+               *[column.icontains(sep + word, autoescape=True) for sep in _WORD_BREAKS])
+
+
+# Lots for new_booking's search box, each with its address loaded, in one query.
+# Every word must match the start of a word in the lot's name, address, city,
+# landmark or pincode (so "4110" finds pincode 411001). Results are ranked by
+# free spots; with no term, all lots are returned in id order.
+def search_lots(term):
+    query = ParkingLot.query.join(ParkingLot.address).options(contains_eager(ParkingLot.address))
+    words = re.findall(r'\w+', (term or '').lower())
+    if not words:
+        return query.order_by(ParkingLot.id).all()
+
+    if _has_fts('lot_fts'):
+        phrase = ' '.join(_match_phrase(word) + '*' for word in words)
+        matching = text('SELECT rowid FROM lot_fts WHERE lot_fts MATCH :lots_q').bindparams(lots_q=phrase)
+        query = query.filter(ParkingLot.id.in_(matching))
+    else:
+        columns = (ParkingLot.name, Address.address, Address.city, Address.landmark, Address.pincode)
+        query = query.filter(and_(*[
+            or_(*[_word_prefix(column, word) for column in columns]) for word in words
+        ]))
+    return query.order_by(ParkingLot.available_count.desc(), ParkingLot.id).all()
@@ -0,0 +1,369 @@
+import heapq
+import math
+import random
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import Date, DateTime, func, insert, select, update
+from werkzeug.security import generate_password_hash
+from app import app
+from billing import expiry_cost, reservation_cost
+from models import db, Address, User, Vehicle, ParkingLot, ParkingSpot, Reservation, DailyLotStats, DailyUserStats
+from occupancy import adjust_lot_counts
+from provisioning import provision_spots
+from search_index import deferred_index
+
+
+# Deterministic synthetic data for scale testing (`flask seed`).
+#
+# Users come with an address, a phone and one or two vehicles. Lots are spread
+# over a few cities, each with a level/row/bay spot layout. Reservations follow
+# a weekly and daily arrival pattern (weekday commute peaks, quieter Sundays,
+# slow growth over the period), busier lots and heavier users, and log-normal
+# stay lengths. As in the app, a booking is for one hour: stays that run past
+# the grace period end Expired with overstay charged, the rest are Released.
+# Each spot hosts one reservation at a time. Finally some spots are occupied by
+# Active reservations made just before `until`.
+#
+# The same arguments always give the same data (on the same starting
+# database). Rows go in with batched bulk inserts, indexes and the search
+# index are built in one pass afterwards and the daily rollups are worked out
+# as the rows are generated. Run it with no other writers, ideally on a fresh
+# database.
+
+AREAS = [
+    ('Koramangala', 'Bengaluru', '560034'), ('Indiranagar', 'Bengaluru', '560038'),
+    ('Whitefield', 'Bengaluru', '560066'), ('Andheri West', 'Mumbai', '400053'),
+    ('Bandra', 'Mumbai', '400050'), ('Powai', 'Mumbai', '400076'),
+    ('Connaught Place', 'New Delhi', '110001'), ('Saket', 'New Delhi', '110017'),
+    ('Hinjewadi', 'Pune', '411057'), ('Shivajinagar', 'Pune', '411005'),
+    ('Salt Lake', 'Kolkata', '700091'), ('Park Street', 'Kolkata', '700016'),
+    ('T Nagar', 'Chennai', '600017'), ('Gachibowli', 'Hyderabad', '500032'),
+    ('Banjara Hills', 'Hyderabad', '500034'),
+]
+STATES = {
+    'Bengaluru': ('Karnataka', 'KA'), 'Mumbai': ('Maharashtra', 'MH'), 'New Delhi': ('Delhi', 'DL'),
+    'Pune': ('Maharashtra', 'MH'), 'Kolkata': ('West Bengal', 'WB'), 'Chennai': ('Tamil Nadu', 'TN'),
+    'Hyderabad': ('Telangana', 'TS'),
+}
+LOT_KINDS = ['Central Parking', 'Metro Parking', 'Mall Parking', 'Tech Park Parking', 'Market Parking',
+             'Plaza Parking']
+STREETS = ['MG Road', 'Station Road', 'Main Road', 'Church Street', 'Lake View Road', 'Temple Street',
+           'Park Avenue', 'Ring Road', 'Hill Road', 'Market Road']
+FIRST_NAMES = ['Aarav', 'Priya', 'Rohan', 'Ananya', 'Vikram', 'Sneha', 'Arjun', 'Kavya', 'Rahul', 'Meera',
+               'Aditya', 'Isha', 'Karan', 'Diya', 'Siddharth', 'Pooja', 'Nikhil', 'Riya', 'Varun', 'Neha']
+LAST_NAMES = ['Sharma', 'Patel', 'Reddy', 'Iyer', 'Singh', 'Gupta', 'Nair', 'Das', 'Mehta', 'Rao',
+              'Kulkarni', 'Banerjee', 'Joshi', 'Menon', 'Chopra', 'Saha', 'Verma', 'Pillai', 'Bose', 'Shah']
+VEHICLE_TYPES = ['Car', 'Car', 'Car', 'SUV', 'Bike']
+RATES = [20, 30, 40, 50, 60]
+
+# Relative arrivals by hour of day and by weekday (Monday first)
+HOURLY = [1, 1, 1, 1, 1, 2, 4, 8, 12, 12, 10, 9, 9, 9, 8, 8, 9, 11, 12, 10, 7, 5, 3, 2]
+WEEKLY = [1.0, 1.0, 1.0, 1.0, 1.1, 1.3, 0.8]
+
+# Stay lengths: log-normal around a 50 minute median, from 10 minutes to 12 hours
+STAY_MEDIAN_MINUTES = 50
+STAY_SIGMA = 0.9
+BOOKED = timedelta(hours=1)  # what book_spot books
+
+INSERT_BATCH = 10_000
+
+Seeded = namedtuple('Seeded', 'user_emails lot_ids reservations active')
+
+
+# Plates are numbered by user id (second vehicles from SECOND_PLATES on), so
+# generated plates never repeat, also across runs into one database
+SECOND_PLATES = 300_000_000
+
+
+def _plate(i, state_code):
+    # Unique for every i below 99 * 676 * 10,000
+    letters = chr(65 + i // 10_000 % 676 // 26) + chr(65 + i // 10_000 % 26)
+    return f'{state_code}{i // 6_760_000 % 99 + 1:02d}{letters}{i % 10_000:04d}'
+
+
+def _insert_returning_ids(model, rows):
+    ids = []
+    for start in range(0, len(rows), INSERT_BATCH):
+        ids += db.session.execute(
+            insert(model).returning(model.id, sort_by_parameter_order=True), rows[start:start + INSERT_BATCH]
+        ).scalars().all()
+    return ids
+
+
+# Plain Core inserts skip the ORM's per-row bookkeeping
+def _insert(model, rows):
+    for start in range(0, len(rows), INSERT_BATCH):
+        db.session.execute(insert(model.__table__), rows[start:start + INSERT_BATCH])
+
+
+# `count` users with addresses, phones and vehicles, 60% registered before
+# `since` and the rest spread after it. Returns [(id, email, plate, registered_on)].
+def seed_users(rng, count, since, days, email_domain, password):
+    password_hash = generate_password_hash(password)
+    people, addresses = [], []
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        area, city, pincode = rng.choice(AREAS)
+        if rng.random() < 0.6:
+            registered_on = since - timedelta(days=rng.random() * 365)
+        else:
+            registered_on = since + timedelta(days=rng.random() * days)
+        people.append((first, last, city, registered_on))
+        addresses.append({'address': f'{rng.randint(1, 999)}, {rng.choice(STREETS)}, {area}', 'city': city,
+                          'state': STATES[city][0], 'pincode': pincode})
+    address_ids = _insert_returning_ids(Address, addresses)
+
+    user_ids = _insert_returning_ids(User, [
+        {'full_name': f'{first} {last}', 'email': f'{first}.{last}{i}{email_domain}'.lower(),
+         'password': password_hash, 'phone': f'9{rng.randrange(10 ** 9):09d}', 'is_admin': False,
+         'registered_on': registered_on, 'address_id': address_id}
+        for i, ((first, last, city, registered_on), address_id) in enumerate(zip(people, address_ids))
+    ])
+
+    users, vehicles = [], []
+    for i, (user_id, (first, last, city, registered_on)) in enumerate(zip(user_ids, people)):
+        state_code = STATES[city][1]
+        plate = _plate(user_id, state_code)
+        vehicles.append({'user_id': user_id, 'plate_number': plate, 'vehicle_type': rng.choice(VEHICLE_TYPES),
+                         'registered_on': registered_on})
+        if rng.random() < 0.2:
+            vehicles.append({'user_id': user_id, 'plate_number': _plate(SECOND_PLATES + user_id, state_code),
+                             'vehicle_type': rng.choice(VEHICLE_TYPES), 'registered_on': registered_on})
+        users.append((user_id, f'{first}.{last}{i}{email_domain}'.lower(), plate, registered_on))
+    _insert(Vehicle, vehicles)
+    return users
+
+
+# `count` lots of `spots_per_lot` spots each. Returns [(lot id, rate, [spot ids])].
+def seed_lots(rng, count, spots_per_lot, name_prefix=''):
+    lots = []
+    for i in range(count):
+        area, city, pincode = AREAS[i % len(AREAS)]
+        kind = LOT_KINDS[i // len(AREAS) % len(LOT_KINDS)]
+        name = f'{name_prefix}{area} {kind}'
+        if i >= len(AREAS) * len(LOT_KINDS):
+            name += f' {i // (len(AREAS) * len(LOT_KINDS)) + 1}'
+        address = Address(address=f'{rng.randint(1, 200)}, {rng.choice(STREETS)}, {area}', city=city,
+                          state=STATES[city][0], pincode=pincode, landmark=f'Near {area} {rng.choice(("Metro", "Mall", "Market"))}')
+        db.session.add(address)
+        db.session.flush()
+        lot = ParkingLot(name=name, price_per_hour=rng.choice(RATES), max_spots=spots_per_lot,
+                         rows_per_level=rng.choice((10, 20)), bays_per_row=50, address_id=address.id)
+        db.session.add(lot)
+        db.session.flush()
+        provision_spots(lot, spots_per_lot)
+        spot_ids = db.session.execute(
+            select(ParkingSpot.id).where(ParkingSpot.lot_id == lot.id).order_by(ParkingSpot.id)
+        ).scalars().all()
+        lots.append((lot.id, lot.price_per_hour, spot_ids))
+    return lots
+
+
+# Indexes are built once after a load of `count` rows rather than updated row
+# by row, unless the table already holds more than that
+@contextmanager
+def _indexes_deferred(model, count):
+    conn = db.session.connection()
+    table = model.__table__
+    indexes = table.indexes if (conn.scalar(select(func.max(table.c.id))) or 0) < count else ()
+    for index in indexes:
+        index.drop(conn)
+    try:
+        yield
+    except BaseException:
+        # The DROPs may have been committed already (see deferred_index)
+        db.session.rollback()
+        for index in indexes:
+            index.create(db.session.connection(), checkfirst=True)
+        db.session.commit()
+        raise
+    for index in indexes:
+        index.create(conn)
+
+
+# Reservation rows are tuples in this column order
+RESERVATION_COLUMNS = ('user_id', 'spot_id', 'vehicle_plate', 'status', 'start_time', 'end_time', 'final_cost')
+
+# How SQLAlchemy stores dates and datetimes in SQLite
+_SQLITE_FORMATS = {
+    DateTime: lambda value: value.isoformat(' ', 'microseconds'),
+    Date: lambda value: value.isoformat(),
+}
+
+
+# Insert tuples of `columns` values. Python-side column defaults are not
+# applied, so pass every column that has one. SQLite gets the rows straight
+# through the DBAPI cursor, with dates formatted as SQLAlchemy would; other
+# databases through Core.
+def _insert_tuples(model, columns, rows):
+    if not rows:
+        return
+    conn = db.session.connection()
+    table = model.__table__
+    if conn.dialect.name != 'sqlite':
+        for start in range(0, len(rows), INSERT_BATCH):
+            conn.execute(insert(table), [dict(zip(columns, row)) for row in rows[start:start + INSERT_BATCH]])
+        return
+    formats = [(i, _SQLITE_FORMATS[type(table.c[name].type)]) for i, name in enumerate(columns)
+               if type(table.c[name].type) in _SQLITE_FORMATS]
+    if formats:
+        values = list(zip(*rows))
+        for i, format_value in formats:
+            values[i] = [value if value is None else format_value(value) for value in values[i]]
+        rows = list(zip(*values))
+    conn.exec_driver_sql(
+        f'INSERT INTO {table.name} ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))})', rows
+    )
+
+
+# Daily rollups of the generated rows, by the same rules as
+# rollups.backfill_rollups, keyed by days since `since`. The lots and users
+# are new, so their rollup rows are too and can simply be inserted.
+class _Rollups:
+    def __init__(self, since):
+        self.since = since
+        self.lots = defaultdict(lambda: [0, 0.0, 0.0])  # bookings, revenue, hours_parked
+        self.users = defaultdict(lambda: [0, 0, 0.0, 0.0])  # registered, bookings, spent, hours_parked
+
+    def day(self, moment):
+        return (moment - self.since).days
+
+    def registration(self, user_id, registered_on):
+        self.users[(self.day(registered_on), user_id)][0] += 1
+
+    def booking(self, lot_id, user_id, day):
+        self.lots[(day, lot_id)][0] += 1
+        self.users[(day, user_id)][1] += 1
+
+    def write(self):
+        since = self.since.date()
+        dates = {day: since + timedelta(days=day) for day, _ in self.users.keys() | self.lots.keys()}
+        _insert_tuples(DailyLotStats, ('day', 'lot_id', 'bookings', 'revenue', 'hours_parked'), [
+            (dates[day], lot_id, *totals) for (day, lot_id), totals in self.lots.items()
+        ])
+        _insert_tuples(DailyUserStats, ('day', 'user_id', 'registered', 'bookings', 'spent', 'hours_parked'), [
+            (dates[day], user_id, *totals) for (day, user_id), totals in self.users.items()
+        ])
+
+
+# `count` finished reservations over the `days` days from `since`
+def seed_history(rng, users, lots, count, since, days, rollups):
+    day_weights = [WEEKLY[(since + timedelta(days=d)).weekday()] * (0.6 + 0.4 * d / days) for d in range(days)]
+    day_of = rng.choices(range(days), weights=day_weights, k=count)
+    hour_of = rng.choices(range(24), weights=HOURLY, k=count)
+    lot_of = rng.choices(range(len(lots)), weights=[rng.lognormvariate(0, 0.6) for _ in lots], k=count)
+    user_of = rng.choices(range(len(users)), weights=[rng.paretovariate(1.5) for _ in users], k=count)
+    early = [i for i, user in enumerate(users) if user[3] <= since]
+    registered = [(user[3] - since).total_seconds() for user in users]
+
+    grace = timedelta(minutes=app.config['EXPIRY_GRACE_MINUTES'])
+    sweep_interval = app.config['EXPIRY_INTERVAL']
+    mu = math.log(STAY_MEDIAN_MINUTES * 60)
+
+    arrivals = []
+    for n in range(count):
+        start = day_of[n] * 86400 + hour_of[n] * 3600 + rng.random() * 3600
+        user = user_of[n]
+        if registered[user] > start and early:
+            # Nobody books before they register
+            user = early[rng.randrange(len(early))]
+        stay = min(max(math.exp(rng.gauss(mu, STAY_SIGMA)), 600), 43200)
+        arrivals.append((start, stay, lot_of[n], user, rng.random()))
+    arrivals.sort()
+
+    # Each lot hands out the spot that has been free longest; when they are
+    # all taken the driver waits for the first one to come free.
+    free = [[(0.0, spot_id) for spot_id in spot_ids] for _, _, spot_ids in lots]
+    released_within = 3600 + grace.total_seconds()
+    heapreplace = heapq.heapreplace
+    # The rollup totals are updated inline: this loop runs once per row
+    lot_totals, user_totals = rollups.lots, rollups.users
+    rows = []
+    with deferred_index('reservation'), _indexes_deferred(Reservation, count):
+        for start, stay, lot, user, jitter in arrivals:
+            spots = free[lot]
+            free_at, spot_id = spots[0]
+            start = max(start, free_at)
+            lot_id, rate, _ = lots[lot]
+            user_id, _, plate, _ = users[user]
+            start_time = since + timedelta(seconds=start)
+            if stay <= released_within:
+                end_time = start_time + timedelta(seconds=stay)
+                status, cost = 'Released', reservation_cost(start_time, end_time, rate)
+            else:
+                # Left to the expiry sweep, which runs every EXPIRY_INTERVAL seconds
+                booked_end = start_time + BOOKED
+                end_time = booked_end + grace + timedelta(seconds=jitter * sweep_interval)
+                status, cost = 'Expired', expiry_cost(start_time, booked_end, end_time, rate)
+            parked = (end_time - start_time).total_seconds()
+            heapreplace(spots, (start + parked, spot_id))
+            rows.append((user_id, spot_id, plate, status, start_time, end_time, cost))
+
+            start_day, end_day = (start_time - since).days, (end_time - since).days
+            lot_totals[(start_day, lot_id)][0] += 1
+            user_totals[(start_day, user_id)][1] += 1
+            lot_row, user_row = lot_totals[(end_day, lot_id)], user_totals[(end_day, user_id)]
+            lot_row[1] += cost
+            lot_row[2] += parked / 3600
+            user_row[2] += cost
+            user_row[3] += parked / 3600
+            if len(rows) == INSERT_BATCH:
+                _insert_tuples(Reservation, RESERVATION_COLUMNS, rows)
+                rows = []
+        _insert_tuples(Reservation, RESERVATION_COLUMNS, rows)
+    return count, free
+
+
+# Active reservations on about `occupancy` of each lot's spots, booked in the
+# hour before `until`, with the spots and lot counters marked occupied
+def seed_active(rng, users, lots, free, occupancy, since, until, rollups):
+    rows, occupied = [], defaultdict(list)
+    now = (until - since).total_seconds()
+    for lot, (lot_id, _, spot_ids) in enumerate(lots):
+        wanted = min(round(len(spot_ids) * occupancy * rng.uniform(0.7, 1.3)), len(spot_ids))
+        for _ in range(wanted):
+            start = now - rng.random() * 3300
+            free_at, spot_id = heapq.heappop(free[lot])
+            if free_at > start:
+                heapq.heappush(free[lot], (free_at, spot_id))
+                break
+            user_id, _, plate, _ = users[rng.randrange(len(users))]
+            start_time = since + timedelta(seconds=start)
+            rows.append((user_id, spot_id, plate, 'Active', start_time, start_time + BOOKED, None))
+            rollups.booking(lot_id, user_id, rollups.day(start_time))
+            occupied[lot_id].append(spot_id)
+    with deferred_index('reservation'):
+        _insert_tuples(Reservation, RESERVATION_COLUMNS, rows)
+    for lot_id, spot_ids in occupied.items():
+        for start in range(0, len(spot_ids), INSERT_BATCH):
+            db.session.execute(
+                update(ParkingSpot).where(ParkingSpot.id.in_(spot_ids[start:start + INSERT_BATCH])).values(status='O'),
+                execution_options={'synchronize_session': False}
+            )
+        adjust_lot_counts(lot_id, 'A', 'O', len(spot_ids))
+    return len(rows)
+
+
+# Generate a whole data set. History covers the `days` whole days before the
+# day of `until`. Returns the emails and lot ids created and the reservation counts.
+def seed(users=10_000, lots=50, spots_per_lot=2_000, reservations=1_000_000, days=365, seed=0,
+         until=None, occupancy=0.3, email_domain='@seed.example', lot_prefix='', password='password'):
+    rng = random.Random(seed)
+    until = until or datetime.utcnow().replace(second=0, microsecond=0)
+    since = datetime.combine(until.date(), datetime.min.time()) - timedelta(days=days)
+    rollups = _Rollups(since)
+
+    with deferred_index('user'):
+        seeded_users = seed_users(rng, users, since, days, email_domain, password)
+    for user_id, _, _, registered_on in seeded_users:
+        rollups.registration(user_id, registered_on)
+    db.session.commit()
+    seeded_lots = seed_lots(rng, lots, spots_per_lot, lot_prefix)
+    db.session.commit()
+    history, free = seed_history(rng, seeded_users, seeded_lots, reservations, since, days, rollups)
+    db.session.commit()
+    active = seed_active(rng, seeded_users, seeded_lots, free, occupancy, since, until, rollups)
+    rollups.write()
+    db.session.commit()
+    return Seeded([user[1] for user in seeded_users], [lot[0] for lot in seeded_lots], history, active)
@@ -0,0 +1,153 @@
+import threading
+from collections import namedtuple
+from sqlalchemy import event
+from app import app
+from events import publish_changes
+from models import db, ParkingSpot
+
+
+FreeSpot = namedtuple('FreeSpot', 'id spot_number')
+
+
+# In-memory index of free spots per lot.
+#
+# Each lot keeps its spot ids in id order and an int bitmask where bit i is set
+# when spot i is free, so "first free", "count free" and "list free" never touch
+# the database. The index is per process and only a hint: claims still go
+# through the conditional UPDATE in allocation.py, and a lot whose free count
+# disagrees with ParkingLot.available_count is reloaded.
+class LotIndex:
+    def __init__(self, lot_id, rows):
+        self.lot_id = lot_id
+        self.spot_ids = [row[0] for row in rows]
+        self.spot_numbers = [row[1] for row in rows]
+        self.position = {spot_id: i for i, spot_id in enumerate(self.spot_ids)}
+        self.free_mask = 0
+        self.lock = threading.Lock()
+        for i, row in enumerate(rows):
+            if row[2] == 'A':
+                self.free_mask |= 1 << i
+
+    def count_free(self):
+        return self.free_mask.bit_count()
+
+    def first_free(self):
+        if not self.free_mask:
+            return None
+        return self.spot_ids[(self.free_mask & -self.free_mask).bit_length() - 1]
+
+    # First free spot, marked taken so concurrent callers get different spots
+    def take_first_free(self):
+        with self.lock:
+            spot_id = self.first_free()
+            if spot_id is not None:
+                self.free_mask &= ~(1 << self.position[spot_id])
+            return spot_id
+
+    def free_spots(self):
+        spots = []
+        mask = self.free_mask
+        while mask:
+            low = mask & -mask
+            i = low.bit_length() - 1
+            spots.append(FreeSpot(self.spot_ids[i], self.spot_numbers[i]))
+            mask ^= low
+        return spots
+
+    # Returns False when the spot is unknown and the lot needs a reload
+    def mark(self, spot_id, status):
+        i = self.position.get(spot_id)
+        if i is None:
+            return False
+        with self.lock:
+            if status == 'A':
+                self.free_mask |= 1 << i
+            else:
+                self.free_mask &= ~(1 << i)
+        return True
+
+
+_lots = {}
+_lock = threading.Lock()
+
+
+def _load(lot_id):
+    rows = db.session.query(
+        ParkingSpot.id, ParkingSpot.spot_number, ParkingSpot.status
+    ).filter(ParkingSpot.lot_id == lot_id).order_by(ParkingSpot.id).all()
+    index = LotIndex(lot_id, rows)
+    with _lock:
+        _lots[lot_id] = index
+    return index
+
+
+# Index for lot_id, loading it on first use. Returns None when the index is
+# disabled so callers fall back to their SQL query. Pass the lot's
+# available_count as expected_free to reload a lot that has gone stale.
+def get_lot_index(lot_id, expected_free=None):
+    if not app.config.get('SPOT_INDEX_ENABLED', True):
+        return None
+    index = _lots.get(lot_id)
+    if index is None or (expected_free is not None and index.count_free() != expected_free):
+        index = _load(lot_id)
+    return index
+
+
+# Free spots of a lot as (id, spot_number) pairs, from the index when it is
+# enabled and from the database otherwise
+def list_free_spots(lot_id, expected_free=None):
+    index = get_lot_index(lot_id, expected_free)
+    if index is not None:
+        return index.free_spots()
+    rows = db.session.query(ParkingSpot.id, ParkingSpot.spot_number).filter(
+        ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A'
+    ).order_by(ParkingSpot.id).all()
+    return [FreeSpot(*row) for row in rows]
+
+
+def invalidate(lot_id=None):
+    with _lock:
+        if lot_id is None:
+            _lots.clear()
+        else:
+            _lots.pop(lot_id, None)
+
+
+# Compare a lot's index with the database; returns the spot ids that disagree
+# and reloads the lot if any do.
+def verify_lot_index(lot_id):
+    index = _lots.get(lot_id)
+    if index is None:
+        return []
+    rows = db.session.query(ParkingSpot.id, ParkingSpot.status).filter(ParkingSpot.lot_id == lot_id).all()
+    actual = {spot_id for spot_id, status in rows if status == 'A'}
+    indexed = {spot.id for spot in index.free_spots()}
+    mismatched = sorted(actual ^ indexed)
+    if mismatched or len(rows) != len(index.spot_ids):
+        _load(lot_id)
+    return mismatched
+
+
+# Changes are queued on the session and applied only once the transaction
+# commits, so a rolled-back booking never leaks into the index or reaches the
+# live occupancy stream (events.py).
+def record_change(lot_id, spot_id=None, status=None):
+    db.session.info.setdefault('spot_index_changes', []).append((lot_id, spot_id, status))
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_changes(session):
+    changes = session.info.pop('spot_index_changes', [])
+    with _lock:
+        for lot_id, spot_id, status in changes:
+            index = _lots.get(lot_id)
+            if index is None:
+                continue
+            if spot_id is None or not index.mark(spot_id, status):
+                _lots.pop(lot_id, None)
+    publish_changes(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('spot_index_changes', None)
@@ -0,0 +1,150 @@
+import re
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from datetime import datetime
+from flask import before_render_template, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from app import app
+from models import db
+
+
+# Opt-in per-request SQL profiling (SQL_PROFILE_ENABLED).
+#
+# Engine events time every statement a request runs. Statements are reduced to
+# fingerprints (numbers, strings and IN lists collapsed), and a fingerprint run
+# SQL_PROFILE_REPEAT or more times in one request is reported as an N+1
+# suspect: typically a relationship lazy-loaded inside a loop. Template render
+# time comes from Flask's template signals and includes the SQL of lazy loads
+# made while rendering.
+#
+# Every response gets the numbers as headers (X-SQL-Queries, X-SQL-Time-Ms,
+# X-SQL-Repeated, X-Template-Time-Ms and a Server-Timing entry for browser dev
+# tools), and the last SQL_PROFILE_HISTORY requests are kept per process for
+# /admin/perf, which lists the worst of them.
+
+Profile = namedtuple('Profile', 'at method path endpoint status queries sql_ms template_ms total_ms suspects')
+Suspect = namedtuple('Suspect', 'fingerprint count sql_ms')
+
+_history = deque(maxlen=app.config['SQL_PROFILE_HISTORY'])
+_history_lock = threading.Lock()
+
+_NUMBER = re.compile(r'\b\d+(\.\d+)?\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_IN_LIST = re.compile(r'\((\s*\?\s*,)+\s*\?\s*\)|\((\s*%\(\w+\)s\s*,)+\s*%\(\w+\)s\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+# The statement with its literals and parameter lists collapsed, so the same
+# query with other values has the same fingerprint
+def fingerprint(statement):
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    statement = _IN_LIST.sub('(?, ...)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+
+class _RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.statements = Counter()
+        self.statement_seconds = Counter()
+        self.template_seconds = 0.0
+        self.rendering = []  # start times of the templates being rendered
+
+    def suspects(self):
+        repeat = app.config['SQL_PROFILE_REPEAT']
+        return [
+            Suspect(statement, count, self.statement_seconds[statement] * 1000)
+            for statement, count in self.statements.most_common() if count >= repeat
+        ]
+
+
+def _current():
+    return g.get('sql_profile') if has_request_context() else None
+
+
+# ------------------------------------------------------ HOOKS ------------------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        context.sql_profile_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _current()
+    started = getattr(context, 'sql_profile_started', None)
+    if profile is None or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    key = fingerprint(statement)
+    profile.queries += 1
+    profile.sql_seconds += elapsed
+    profile.statements[key] += 1
+    profile.statement_seconds[key] += elapsed
+
+
+def _before_render(sender, template, context, **extra):
+    profile = _current()
+    if profile is not None:
+        profile.rendering.append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    profile = _current()
+    if profile is not None and profile.rendering:
+        started = profile.rendering.pop()
+        if not profile.rendering:
+            # Templates rendered from within a template are already included
+            profile.template_seconds += time.perf_counter() - started
+
+
+def _start_profile():
+    g.sql_profile = _RequestProfile()
+
+
+def _finish_profile(response):
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+        return response
+    sql_ms, template_ms = profile.sql_seconds * 1000, profile.template_seconds * 1000
+    suspects = profile.suspects()
+    response.headers['X-SQL-Queries'] = str(profile.queries)
+    response.headers['X-SQL-Time-Ms'] = f'{sql_ms:.1f}'
+    response.headers['X-SQL-Repeated'] = ', '.join(str(suspect.count) for suspect in suspects) or '0'
+    response.headers['X-Template-Time-Ms'] = f'{template_ms:.1f}'
+    response.headers.add('Server-Timing', f'sql;dur={sql_ms:.1f};desc="{profile.queries} queries"')
+    response.headers.add('Server-Timing', f'template;dur={template_ms:.1f}')
+    with _history_lock:
+        _history.append(Profile(
+            datetime.now(), request.method, request.full_path.rstrip('?'), request.endpoint, response.status_code,
+            profile.queries, sql_ms, template_ms, (time.perf_counter() - profile.started) * 1000, suspects
+        ))
+    return response
+
+
+def install():
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+
+
+def enabled():
+    return app.config['SQL_PROFILE_ENABLED']
+
+
+# The `limit` kept requests with the most SQL time, then the most queries
+def worst_requests(limit=50):
+    with _history_lock:
+        profiles = list(_history)
+    return sorted(profiles, key=lambda profile: (profile.sql_ms, profile.queries), reverse=True)[:limit]
+
+
+if enabled():
+    install()
@@ -0,0 +1,125 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event, extract, func, select
+from sqlalchemy.sql.expression import case
+from app import app
+from models import db, User, ParkingSpot, Reservation
+from rollups import bookings_by_lot, hours_between, revenue_by_day
+
+
+# Everything the admin dashboard shows, in four queries no matter how many
+# lots, spots or reservations exist.
+def dashboard_snapshot(now=None):
+    # UTC, as the rollup tables key their days (rollups.py)
+    now = now or datetime.utcnow()
+
+    # 1. Users and active reservations
+    total_users, active_reservations = db.session.execute(select(
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.count(Reservation.id)).where(Reservation.status == 'Active').scalar_subquery()
+    )).one()
+
+    # 2. Spots by status
+    status_counts = dict(db.session.query(
+        ParkingSpot.status, func.count(ParkingSpot.id)
+    ).group_by(ParkingSpot.status).all())
+
+    # 3. Bookings by lot (lots without bookings included), from the daily rollup
+    lot_rows = bookings_by_lot()
+
+    # 4. Revenue by day for the last 7 days, from the daily rollup
+    days = [now - timedelta(days=i) for i in range(6, -1, -1)]
+    revenue = revenue_by_day(days[0].date(), days[-1].date())
+
+    return {
+        'stats': {
+            'total_users': total_users,
+            'total_lots': len(lot_rows),
+            'total_spots': sum(status_counts.values()),
+            'active_reservations': active_reservations
+        },
+        'spot_status': {
+            'available': status_counts.get('A', 0),
+            'occupied': status_counts.get('O', 0),
+            'maintenance': status_counts.get('M', 0)
+        },
+        'lot_names': [name for name, _ in lot_rows],
+        'lot_bookings': [count for _, count in lot_rows],
+        'revenue_labels': [day.strftime('%a') for day in days],
+        'revenue_data': [revenue.get(day.date(), 0.0) for day in days]
+    }
+
+
+# ---------------------------------------------------- PER USER ----------------------------------------------------
+
+_user_stats = {}
+_user_stats_lock = threading.Lock()
+
+
+# Totals for one user from a single GROUP BY over their reservations by month.
+# Returns totals plus 'months': {(year, month): {'bookings', 'cost'}} by start time.
+def _compute_user_stats(user_id):
+    released = Reservation.status == 'Released'
+    year = extract('year', Reservation.start_time)
+    month = extract('month', Reservation.start_time)
+    rows = db.session.query(
+        year, month,
+        func.count(Reservation.id),
+        func.sum(case((released, 1), else_=0)),
+        func.sum(case((Reservation.status == 'Active', 1), else_=0)),
+        func.sum(case((released & Reservation.end_time.isnot(None),
+                       hours_between(Reservation.start_time, Reservation.end_time)), else_=0)),
+        func.coalesce(func.sum(Reservation.final_cost), 0.0)
+    ).filter(Reservation.user_id == user_id).group_by(year, month).all()
+
+    stats = {'total_bookings': 0, 'completed': 0, 'active': 0, 'total_hours': 0.0, 'total_spent': 0.0, 'months': {}}
+    for y, m, bookings, completed, active, hours, cost in rows:
+        stats['total_bookings'] += bookings
+        stats['completed'] += completed or 0
+        stats['active'] += active or 0
+        stats['total_hours'] += float(hours or 0)
+        stats['total_spent'] += float(cost or 0)
+        stats['months'][(int(y), int(m))] = {'bookings': bookings, 'cost': float(cost or 0)}
+    stats['avg_duration'] = stats['total_hours'] / stats['completed'] if stats['completed'] else 0.0
+    return stats
+
+
+# Cached per-user stats. Entries are dropped when the user's reservations
+# change (see _track_reservation_changes) and expire after USER_STATS_TTL
+# seconds so other worker processes never serve stale numbers for long.
+def user_stats(user_id):
+    entry = _user_stats.get(user_id)
+    if entry and time.monotonic() - entry[0] < app.config['USER_STATS_TTL']:
+        return entry[1]
+    stats = _compute_user_stats(user_id)
+    with _user_stats_lock:
+        _user_stats[user_id] = (time.monotonic(), stats)
+    return stats
+
+
+def invalidate_user_stats(*user_ids):
+    with _user_stats_lock:
+        for user_id in user_ids:
+            _user_stats.pop(user_id, None)
+
+
+# Remember whose reservations were written in this transaction and drop their
+# cached stats once it commits. Bulk query.delete() calls bypass this and must
+# call invalidate_user_stats() themselves.
+@event.listens_for(db.session, 'after_flush')
+def _track_reservation_changes(session, flush_context):
+    changed = session.info.setdefault('user_stats_changed', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Reservation):
+            changed.add(obj.user_id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _drop_changed_user_stats(session):
+    invalidate_user_stats(*session.info.pop('user_stats_changed', ()))
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changed_user_stats(session):
+    session.info.pop('user_stats_changed', None)